@@ -0,0 +1,54 @@
+"""
+decode_status throughput of the sample codec with the pure Lua bit.lua and
+with the native bit module, with JSON strings or Lua tables passed between
+Python and Lua, plus the raw cost of the bit operations themselves.
+
+    python benchmarks/bench_codec.py [--count 20000]
+"""
+import argparse
+from common import SAMPLE_LUA, SAMPLE_STATUS, setup_lua_environment, measure, report
+
+BIT_OPERATIONS_LUA = """
+function(bit, data)
+    local crc = 0
+    for i = 1, #data do
+        crc = bit.band(bit.bxor(bit.rshift(crc, 1), bit.lshift(data[i], 3)), 0xFF)
+        crc = bit.bor(crc, bit.band(data[i], 0x0F))
+    end
+    return crc
+end
+"""
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--count", type=int, default=20000)
+    args = parser.parse_args()
+    setup_lua_environment()
+    import lupa
+    from core.lua_runtime import MideaCodec, LuaRuntimePool, NATIVE_BIT_LUA
+
+    for native_bit in (False, True):
+        for native_json in (False, True):
+            pool = LuaRuntimePool(native_json=native_json, native_bit=native_bit)
+            codec = MideaCodec(SAMPLE_LUA, sn="0000000000000000000000000000000", pool=pool)
+            frame = codec.build_status(SAMPLE_STATUS)
+            status = codec.decode_status(frame)
+            assert status["crc_valid"] is True, status
+            rate, per_call = measure(lambda: codec.decode_status(frame), args.count)
+            report(f"decode_status ({'native bit' if native_bit else 'bit.lua'}, "
+                   f"{'tables' if native_json else 'JSON strings'})", rate, per_call)
+            codec.release()
+
+    lua = lupa.LuaRuntime()
+    bit_operations = lua.eval(BIT_OPERATIONS_LUA)
+    data = lua.table_from(list(range(256)))
+    pure = lua.eval('dofile("bit.lua")')
+    for name, bit in (("bit.lua", pure), ("native", lua.execute(NATIVE_BIT_LUA))):
+        assert bit_operations(bit, data) == bit_operations(pure, data)
+        rate, per_call = measure(lambda: bit_operations(bit, data), max(args.count // 20, 1))
+        report(f"1536 bit operations ({name})", rate, per_call)
+
+
+if __name__ == "__main__":
+    main()
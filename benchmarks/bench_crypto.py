@@ -0,0 +1,61 @@
+"""
+Per-frame cost of building an outgoing 5A5A packet and of the local ECB
+decryption, creating the LocalSecurity and the AES objects for every frame
+as before, against the shared cipher and the per-device packet template.
+
+    python benchmarks/bench_crypto.py [--count 50000]
+"""
+import argparse
+from common import measure, report
+
+COMMAND = bytes.fromhex("aa20ac00000000000003418100ff03ff000200000000000000000000000003cd")
+DEVICE_ID = 151732604942012
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--count", type=int, default=50000)
+    args = parser.parse_args()
+    from Crypto.Cipher import AES
+    from Crypto.Util.Padding import pad, unpad
+    from core.packet_builder import PacketBuilder
+    from core.security import LocalSecurity
+
+    def legacy_key():
+        return (bytes.fromhex(format(141661095494369103254425781617665632877, 'x')),
+                bytes.fromhex(format(233912452794221312800602098970898185176935770387238278451789080441632479840061417076563, 'x')))
+
+    def legacy_encrypt(raw):
+        key, _ = legacy_key()
+        return AES.new(key, AES.MODE_ECB).encrypt(bytearray(pad(raw, 16)))
+
+    def legacy_decrypt(raw):
+        key, _ = legacy_key()
+        return unpad(AES.new(key, AES.MODE_ECB).decrypt(bytearray(raw)), 16)
+
+    security = LocalSecurity()
+    encrypted = security.aes_encrypt(COMMAND)
+    assert legacy_encrypt(COMMAND) == encrypted
+    assert legacy_decrypt(encrypted) == security.aes_decrypt(encrypted) == COMMAND
+
+    builder = PacketBuilder(DEVICE_ID)
+    packet = builder.build(COMMAND)
+    assert packet[:12] == PacketBuilder(DEVICE_ID, COMMAND).finalize()[:12]
+    assert packet[20:] == PacketBuilder(DEVICE_ID, COMMAND).finalize()[20:]
+
+    for name, func in (
+        ("aes_encrypt (AES.new per frame)", lambda: legacy_encrypt(COMMAND)),
+        ("aes_encrypt (shared cipher)", lambda: security.aes_encrypt(COMMAND)),
+        ("aes_decrypt (AES.new per frame)", lambda: legacy_decrypt(encrypted)),
+        ("aes_decrypt (shared cipher)", lambda: security.aes_decrypt(encrypted)),
+        ("PacketBuilder per frame", lambda: PacketBuilder(DEVICE_ID, COMMAND).finalize()),
+        ("PacketBuilder.build (per-device template)", lambda: builder.build(COMMAND)),
+        ("heartbeat, PacketBuilder per frame", lambda: PacketBuilder(DEVICE_ID, b"\0").finalize(msg_type=0)),
+        ("heartbeat, PacketBuilder.build", lambda: builder.build(b"\0", msg_type=0)),
+    ):
+        rate, per_call = measure(func, args.count)
+        report(name, rate, per_call)
+
+
+if __name__ == "__main__":
+    main()
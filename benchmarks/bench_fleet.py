@@ -0,0 +1,126 @@
+"""
+Load test of MiedaDevice against a fleet of simulated devices on loopback:
+the time until every device is connected (and authenticated for protocol 3),
+the notify frames decoded while running, the control round trips, and the
+time until every device is back after all the connections were dropped.
+
+    python benchmarks/bench_fleet.py [--count 200] [--protocol 3] [--notify 2] [--duration 10]
+"""
+import time
+import asyncio
+import argparse
+from common import SAMPLE_LUA, setup_lua_environment
+from simulator import start_fleet
+
+
+async def wait_until(predicate, timeout):
+    started = time.perf_counter()
+    while not predicate():
+        if time.perf_counter() - started > timeout:
+            return None
+        await asyncio.sleep(0.01)
+    return time.perf_counter() - started
+
+
+async def run(args):
+    from core.device import MiedaDevice
+    from core.engine import MideaEngine
+    from core.lua_runtime import codec_pool
+
+    simulated = await start_fleet(args.count, args.port, args.protocol, args.notify)
+    engine = MideaEngine.instance()
+    engine.connections.limit = args.limit
+    clients = []
+    updates = [0]
+    connects = [0] * len(simulated)
+
+    def update(status):
+        # Called in the engine thread
+        updates[0] += 1
+
+    def connection_update(index):
+        def update_connected(status):
+            if status.get("connected"):
+                connects[index] += 1
+        return update_connected
+
+    for device in simulated:
+        client = MiedaDevice(
+            name=f"sim {device.device_id}", device_id=device.device_id, device_type=0xAC,
+            ip_address="127.0.0.1", port=device.port,
+            token=device.token.hex() if args.protocol == 3 else None,
+            key=device.key.hex() if args.protocol == 3 else None,
+            protocol=args.protocol, model=None, subtype=0, sn=None, sn8=None, lua_file=SAMPLE_LUA
+        )
+        client.set_refresh_interval(args.refresh)
+        client.set_reconnect_policy(0.5, 2)
+        client.register_update(update, ["indoor_temperature", "temperature"])
+        client.register_update(connection_update(len(clients)), ["connected"])
+        clients.append(client)
+
+    def all_connected(times):
+        return all(count >= times for count in connects)
+
+    for client in clients:
+        client.open()
+    elapsed = await wait_until(lambda: all_connected(1), args.timeout)
+    if elapsed is None:
+        print(f"Only {sum(count >= 1 for count in connects)} of {args.count} devices connected")
+    else:
+        print(f"{args.count} devices connected in {elapsed:.2f}s")
+
+    updates[0] = 0
+    await asyncio.sleep(args.duration)
+    print(f"{updates[0]} status updates in {args.duration}s, "
+          f"{sum(device.notifies for device in simulated)} notify frames pushed, "
+          f"{sum(device.heartbeats for device in simulated)} heartbeats, "
+          f"{sum(device.queries for device in simulated)} queries answered")
+
+    started = time.perf_counter()
+    results = await asyncio.gather(
+        *(client.async_set_attributes({"temperature": 22}) for client in clients),
+        return_exceptions=True
+    )
+    acknowledged = sum(1 for result in results if not isinstance(result, Exception))
+    print(f"{acknowledged} of {args.count} controls acknowledged in {time.perf_counter() - started:.2f}s")
+
+    for device in simulated:
+        device.drop_connections()
+    # A device reconnecting at once doesn't report itself disconnected, count the connects instead
+    elapsed = await wait_until(lambda: all_connected(2), args.timeout)
+    if elapsed is None:
+        print(f"Only {sum(count >= 2 for count in connects)} of {args.count} devices reconnected")
+    else:
+        print(f"{args.count} devices reconnected in {elapsed:.2f}s")
+    snapshots = [client.metrics.snapshot() for client in clients]
+    round_trips = [snapshot["round_trip_time"]["max"] for snapshot in snapshots if snapshot["round_trip_time"]["max"]]
+    decodes = [snapshot["decode_time"]["average"] for snapshot in snapshots if snapshot["decode_time"]["average"]]
+    if round_trips and decodes:
+        print(f"Round trip max {max(round_trips):.2f}ms, decode average {sum(decodes) / len(decodes):.3f}ms, "
+              f"{sum(snapshot['frames_received'] for snapshot in snapshots)} frames received")
+    print(f"Connections accepted {sum(device.accepted for device in simulated)}, "
+          f"lua runtimes of the clients {codec_pool.stats()}")
+
+    for client in clients:
+        client.close()
+    await asyncio.sleep(0.5)
+    await asyncio.gather(*(device.stop() for device in simulated))
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--count", type=int, default=200)
+    parser.add_argument("--port", type=int, default=16000)
+    parser.add_argument("--protocol", type=int, choices=[2, 3], default=3)
+    parser.add_argument("--notify", type=float, default=2)
+    parser.add_argument("--refresh", type=int, default=30)
+    parser.add_argument("--limit", type=int, default=4)
+    parser.add_argument("--duration", type=float, default=10)
+    parser.add_argument("--timeout", type=float, default=120)
+    args = parser.parse_args()
+    setup_lua_environment()
+    asyncio.run(run(args))
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,60 @@
+"""
+Cost of the three per-frame debug logs of MiedaDevice._parse_message
+(Received, Decoded, Status update), with the former inspect.stack() based
+logger and eager f-strings against the cached loggers and lazy formatting,
+with DEBUG disabled and enabled (to a NullHandler).
+
+    python benchmarks/bench_logging.py [--count 20000]
+"""
+import argparse
+import inspect
+import logging
+from common import SAMPLE_STATUS, measure, report
+
+FRAME = bytes.fromhex("aa23ac00000000000303c00145660000003c0000000000646e000000000000000000000000f1d3")
+
+
+def legacy_log(log, device_id=None):
+    frm = inspect.stack()[2]
+    mod = inspect.getmodule(frm[0])
+    if device_id is not None:
+        log = f"[{device_id}] {log}"
+    logging.getLogger(mod.__name__).debug(log)
+
+
+def legacy_debug(log, device_id=None):
+    legacy_log(log, device_id)
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--count", type=int, default=20000)
+    args = parser.parse_args()
+    from core.logger import MideaLogger, LazyHex
+    device_id = 151732604942012
+    status = dict(SAMPLE_STATUS)
+
+    def legacy_frame():
+        legacy_debug(f"Received: {FRAME.hex().lower()}")
+        legacy_debug(f"Decoded: {status}")
+        legacy_debug(f"Status update: {status}")
+
+    def lazy_frame():
+        MideaLogger.debug("Received: %s", LazyHex(FRAME), device_id=device_id)
+        MideaLogger.debug("Decoded: %s", status, device_id=device_id)
+        MideaLogger.debug("Status update: %s", status, device_id=device_id)
+
+    logger = logging.getLogger(__name__)
+    logger.addHandler(logging.NullHandler())
+    logger.propagate = False
+    for level in (logging.INFO, logging.DEBUG):
+        logger.setLevel(level)
+        name = logging.getLevelName(level)
+        rate, per_call = measure(legacy_frame, max(args.count // 20, 1))
+        report(f"3 logs per frame, inspect.stack ({name})", rate, per_call)
+        rate, per_call = measure(lazy_frame, args.count)
+        report(f"3 logs per frame, cached and lazy ({name})", rate, per_call)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,91 @@
+"""
+Offline replay of a frame capture (recorded with the capture service)
+through the stream parser, the local decryption and the codec, reporting
+the decode throughput. The messages recovered from the wire frames must be
+the same as the recorded decrypted ones, which makes it a regression check
+of the parser as well.
+
+Without --capture a synthetic protocol 2 capture of the sample codec is
+recorded first, its frames split at random like a TCP stream.
+
+    python benchmarks/bench_replay.py [--capture device.cap] [--lua codec.lua] [--count 5000]
+"""
+import os
+import random
+import time
+import argparse
+import tempfile
+from common import SAMPLE_LUA, SAMPLE_STATUS, setup_lua_environment, report
+
+DEVICE_ID = 151732604942012
+
+
+def record_sample(path, codec, count):
+    from core.capture import FrameRecorder, DIRECTION_RECEIVED, KIND_WIRE, KIND_MESSAGE
+    from core.packet_builder import PacketBuilder
+    builder = PacketBuilder(DEVICE_ID)
+    recorder = FrameRecorder(path, 2, 0xAC, DEVICE_ID, max_bytes=1 << 30)
+    status = dict(SAMPLE_STATUS)
+    pending = b""
+    for index in range(count):
+        status["indoor_temperature"] = 20 + index % 10
+        message = bytes.fromhex(codec.build_status(status))
+        recorder.record(DIRECTION_RECEIVED, KIND_MESSAGE, message)
+        pending += builder.build(message)
+        while len(pending) > 0 and random.random() < 0.7:
+            split = random.randint(1, len(pending))
+            recorder.record(DIRECTION_RECEIVED, KIND_WIRE, pending[:split])
+            pending = pending[split:]
+    if pending:
+        recorder.record(DIRECTION_RECEIVED, KIND_WIRE, pending)
+    recorder.close()
+
+
+def timed(name, iterable):
+    start = time.perf_counter()
+    items = list(iterable)
+    elapsed = time.perf_counter() - start
+    if items:
+        report(f"{name} ({len(items)} frames)", len(items) / elapsed, elapsed * 1000000 / len(items))
+    return items
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--capture", default=None)
+    parser.add_argument("--lua", default=SAMPLE_LUA)
+    parser.add_argument("--count", type=int, default=5000)
+    args = parser.parse_args()
+    lua_file = os.path.abspath(args.lua)
+    capture = os.path.abspath(args.capture) if args.capture else None
+    setup_lua_environment()
+    from core.capture import (
+        read_capture,
+        read_capture_info,
+        replay_wire,
+        replay_messages,
+        DIRECTION_RECEIVED,
+        KIND_MESSAGE
+    )
+    from core.lua_runtime import MideaCodec
+
+    codec = MideaCodec(lua_file, sn="0000000000000000000000000000000")
+    if capture is None:
+        capture = os.path.join(tempfile.mkdtemp(prefix="midea_capture_"), "sample.cap")
+        record_sample(capture, codec, args.count)
+    info = read_capture_info(capture)
+    print(f"Capture of T0x{info.device_type:02X} {info.device_id}, protocol {info.protocol}")
+
+    recorded = [frame.data for frame in read_capture(capture, DIRECTION_RECEIVED, KIND_MESSAGE)]
+    if info.protocol != 3:
+        messages = timed("stream parser and decryption", replay_wire(capture))
+        assert messages == recorded, "The messages parsed from the wire differ from the recorded ones"
+    decoded = timed("decode_status", replay_messages(capture, codec))
+    failed = sum(1 for _, status in decoded if not status)
+    if failed:
+        print(f"{failed} of {len(decoded)} messages decoded to nothing")
+    codec.release()
+
+
+if __name__ == "__main__":
+    main()
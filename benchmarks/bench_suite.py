@@ -0,0 +1,140 @@
+"""
+The hot path of a frame, from the packet and 8370 framing over the stream
+parser to the codec, and a received frame through MiedaDevice end to end,
+with synthetic frames of the sample codec. Reports frames per second and
+the memory allocated per frame.
+
+The results can be saved and later compared, a case slower than the
+baseline by more than the threshold fails the run:
+
+    python benchmarks/bench_suite.py [--count 20000] [--repeat 3] [--save baseline.json]
+    python benchmarks/bench_suite.py --compare baseline.json [--threshold 0.2]
+"""
+import os
+import sys
+import json
+import argparse
+from hashlib import sha256
+from common import SAMPLE_LUA, SAMPLE_STATUS, setup_lua_environment, measure, measure_allocations
+
+DEVICE_ID = 151732604942012
+DEVICE_KEY = bytes(range(32))
+SN = "0000000000000000000000000000000"
+
+
+def framing_cases():
+    from core.packet_builder import PacketBuilder
+    from core.security import LocalSecurity, MSGTYPE_ENCRYPTED_REQUEST, MSGTYPE_ENCRYPTED_RESPONSE
+    from core.stream import StreamBuffer
+    from core.message import MessageQuestCustom
+
+    command = MessageQuestCustom(0xAC, 0x03, bytearray([0x41, 0x81, 0x00, 0xFF, 0x03, 0xFF, 0x00, 0x02])).serialize()
+    builder = PacketBuilder(DEVICE_ID)
+
+    # The same handshake the device answers, giving both ends the session key
+    device, client = LocalSecurity(), LocalSecurity()
+    plain = bytes(range(100, 132))
+    response = device.aes_cbc_encrypt(plain, DEVICE_KEY) + sha256(plain).digest()
+    device.tcp_key(response, DEVICE_KEY)
+    client.tcp_key(response, DEVICE_KEY)
+    packet_8370 = device.encode_8370(bytes(command), MSGTYPE_ENCRYPTED_RESPONSE)
+    assert client.decode_8370(packet_8370)[0] == [bytes(command)]
+
+    packet = builder.build(command)
+    stream_data = packet * 8
+    stream = StreamBuffer()
+
+    def fetch_v2():
+        # A TCP read of 8 packets, split over two feeds
+        stream.feed(stream_data[:700])
+        packets = stream.fetch_v2()
+        stream.feed(stream_data[700:])
+        packets += stream.fetch_v2()
+        assert len(packets) == 8
+
+    return [
+        ("PacketBuilder.finalize", 1, lambda: PacketBuilder(DEVICE_ID, command).finalize()),
+        ("PacketBuilder.build", 1, lambda: builder.build(command)),
+        ("LocalSecurity.encode_8370", 1, lambda: client.encode_8370(command, MSGTYPE_ENCRYPTED_REQUEST)),
+        ("LocalSecurity.decode_8370", 1, lambda: client.decode_8370(packet_8370)),
+        ("StreamBuffer.fetch_v2", 8, fetch_v2),
+    ]
+
+
+def codec_cases():
+    from core.lua_runtime import MideaCodec
+    codec = MideaCodec(SAMPLE_LUA, sn=SN)
+    status = codec.build_status(SAMPLE_STATUS)
+    assert codec.decode_status(status)["crc_valid"] is True
+    return [
+        ("MideaCodec.build_query", 1, lambda: codec.build_query()),
+        ("MideaCodec.build_control", 1, lambda: codec.build_control({"power": "on", "temperature": 25})),
+        ("MideaCodec.decode_status", 1, lambda: codec.decode_status(status)),
+    ]
+
+
+def device_cases():
+    from core.device import MiedaDevice
+    from core.packet_builder import PacketBuilder
+    device = MiedaDevice(
+        name="bench", device_id=DEVICE_ID, device_type=0xAC, ip_address="127.0.0.1", port=6444,
+        token=None, key=None, protocol=2, model=None, subtype=0, sn=SN, sn8=None, lua_file=SAMPLE_LUA
+    )
+    builder = PacketBuilder(DEVICE_ID)
+    frames = []
+    for temperature in (26, 27):
+        # Alternating the indoor temperature, every frame updates an attribute
+        message = bytes.fromhex(device._lua_runtime.build_status(dict(SAMPLE_STATUS, indoor_temperature=temperature)))
+        frames.append(builder.build(message))
+    index = [0]
+
+    def parse():
+        index[0] ^= 1
+        device._parse_message(frames[index[0]])
+
+    return [("MiedaDevice._parse_message (V2)", 1, parse)]
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--count", type=int, default=20000)
+    parser.add_argument("--repeat", type=int, default=3)
+    parser.add_argument("--save", default=None)
+    parser.add_argument("--compare", default=None)
+    parser.add_argument("--threshold", type=float, default=0.2)
+    args = parser.parse_args()
+    save = os.path.abspath(args.save) if args.save else None
+    compare = os.path.abspath(args.compare) if args.compare else None
+    setup_lua_environment()
+
+    baseline = {}
+    if compare is not None:
+        with open(compare) as fp:
+            baseline = json.load(fp)
+    results = {}
+    regressions = []
+    print(f"{'case':<40} {'frames/s':>12} {'us/frame':>10} {'peak B':>8} {'held B':>8}")
+    for name, frames, func in framing_cases() + codec_cases() + device_cases():
+        # The best of the repeats, the others only measure the noise of the machine
+        rate, per_call = max(measure(func, args.count) for _ in range(args.repeat))
+        peak, retained = measure_allocations(func, max(args.count // 10, 1))
+        rate *= frames
+        results[name] = {"rate": rate, "peak": peak, "retained": retained}
+        line = f"{name:<40} {rate:>12,.0f} {per_call / frames:>10.2f} {peak:>8,} {retained:>8.1f}"
+        if name in baseline:
+            change = rate / baseline[name]["rate"] - 1
+            line += f" {change:>+7.1%}"
+            if change < -args.threshold:
+                regressions.append(name)
+        print(line)
+
+    if save is not None:
+        with open(save, "wt") as fp:
+            json.dump(results, fp, indent=2)
+    if regressions:
+        print(f"Slower than the baseline by more than {args.threshold:.0%}: {', '.join(regressions)}")
+        sys.exit(1)
+
+
+if __name__ == "__main__":
+    main()
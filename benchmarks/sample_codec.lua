@@ -0,0 +1,163 @@
+local bit = require "bit"
+-- A cut-down air conditioner codec written the same way as the scripts
+-- downloaded from the Midea cloud, used by the benchmarks and the simulator.
+local JSON = require "cjson"
+
+local BYTE_DEVICE_TYPE = 0xAC
+local BYTE_CONTROL_REQUEST = 0x02
+local BYTE_QUERY_REQUEST = 0x03
+local BYTE_PROTOCOL_HEAD = 0xAA
+local BYTE_PROTOCOL_LENGTH = 0x0A
+
+local MODES = {[1] = "auto", [2] = "cool", [3] = "dry", [4] = "heat", [5] = "fan"}
+local MODE_VALUES = {auto = 1, cool = 2, dry = 3, heat = 4, fan = 5}
+
+local crc8_854_table = {}
+for i = 0, 255 do
+    local crc = i
+    for _ = 1, 8 do
+        if bit.band(crc, 0x01) ~= 0 then
+            crc = bit.bxor(bit.rshift(crc, 1), 0x8C)
+        else
+            crc = bit.rshift(crc, 1)
+        end
+    end
+    crc8_854_table[i] = crc
+end
+
+local function crc8_854(data, first, last)
+    local crc = 0
+    for i = first, last do
+        crc = crc8_854_table[bit.bxor(crc, data[i])]
+    end
+    return crc
+end
+
+local function make_sum(data, first, last)
+    local sum = 0
+    for i = first, last do
+        sum = sum + data[i]
+    end
+    return bit.band(bit.bnot(sum) + 1, 0xFF)
+end
+
+local function string2table(hex)
+    local tb = {}
+    for i = 1, #hex, 2 do
+        tb[#tb + 1] = tonumber(string.sub(hex, i, i + 1), 16)
+    end
+    return tb
+end
+
+local function table2string(tb)
+    local hex = {}
+    for i = 1, #tb do
+        hex[i] = string.format("%02x", tb[i])
+    end
+    return table.concat(hex)
+end
+
+local function on_off(value, mask)
+    if bit.band(value, mask) ~= 0 then
+        return "on"
+    end
+    return "off"
+end
+
+local function switch_bit(value, mask)
+    if value == "on" then
+        return mask
+    end
+    return 0
+end
+
+local function assemble(msg_type, body)
+    body[#body + 1] = crc8_854(body, 1, #body)
+    local msg = {BYTE_PROTOCOL_HEAD, #body + BYTE_PROTOCOL_LENGTH, BYTE_DEVICE_TYPE,
+                 0x00, 0x00, 0x00, 0x00, 0x00, 0x00, msg_type}
+    for i = 1, #body do
+        msg[#msg + 1] = body[i]
+    end
+    msg[#msg + 1] = make_sum(msg, 2, #msg)
+    return table2string(msg)
+end
+
+local function status_body(status, body_type)
+    local temperature = status["temperature"] or 26
+    local small_temperature = status["small_temperature"] or 0
+    local indoor = status["indoor_temperature"] or 25
+    local outdoor = status["outdoor_temperature"] or 30
+    local body = {
+        body_type,
+        switch_bit(status["power"], 0x01),
+        bit.bor(bit.lshift(MODE_VALUES[status["mode"] or "auto"], 5), bit.band(temperature - 16, 0x0F)),
+        bit.band(status["wind_speed"] or 102, 0x7F),
+        0x00, 0x00, 0x00,
+        bit.bor(switch_bit(status["wind_swing_ud"], 0x0C), switch_bit(status["wind_swing_lr"], 0x03)),
+        switch_bit(status["strong_wind"], 0x20),
+        bit.bor(switch_bit(status["eco"], 0x10), bit.bor(switch_bit(status["ptc"], 0x08),
+                switch_bit(status["dry"], 0x04))),
+        switch_bit(status["comfort_sleep"], 0x01),
+        indoor * 2 + 50,
+        outdoor * 2 + 50,
+        0x00,
+        bit.bor(bit.lshift(small_temperature >= 0.5 and 1 or 0, 4), switch_bit(status["comfort_power_save"], 0x01)),
+    }
+    for _ = #body + 1, 22 do
+        body[#body + 1] = 0x00
+    end
+    return body
+end
+
+function jsonToData(jsonCmd)
+    local json = JSON.decode(jsonCmd)
+    local query = json["query"]
+    local control = json["control"]
+    local status = json["status"]
+    if control ~= nil then
+        local body = status_body(control, 0x40)
+        body[4] = bit.bor(body[4], 0x80)
+        return assemble(BYTE_CONTROL_REQUEST, body)
+    elseif status ~= nil then
+        return assemble(BYTE_CONTROL_REQUEST, status_body(status, 0xC0))
+    elseif query ~= nil then
+        local body = {0x41, 0x81, 0x00, 0xFF, 0x03, 0xFF, 0x00, 0x02, 0x00, 0x00, 0x00,
+                      0x00, 0x00, 0x00, 0x00, 0x00, 0x00, 0x00, 0x00, 0x00, 0x03}
+        if query["query_type"] == "prevent_straight_wind" then
+            body = {0xB1, 0x01, 0x42, 0x00}
+        end
+        return assemble(BYTE_QUERY_REQUEST, body)
+    end
+    return nil
+end
+
+function dataToJson(jsonCmd)
+    local json = JSON.decode(jsonCmd)
+    local msg = string2table(json["msg"]["data"])
+    local body = {}
+    for i = 11, #msg - 1 do
+        body[#body + 1] = msg[i]
+    end
+    local status = {}
+    if body[1] == 0xC0 or body[1] == 0x40 then
+        status["power"] = on_off(body[2], 0x01)
+        status["mode"] = MODES[bit.band(bit.rshift(body[3], 5), 0x07)]
+        status["temperature"] = bit.band(body[3], 0x0F) + 16
+        status["small_temperature"] = bit.band(bit.rshift(body[15], 4), 0x01) * 0.5
+        status["wind_speed"] = bit.band(body[4], 0x7F)
+        status["wind_swing_ud"] = on_off(body[8], 0x0C)
+        status["wind_swing_lr"] = on_off(body[8], 0x03)
+        status["strong_wind"] = on_off(body[9], 0x20)
+        status["eco"] = on_off(body[10], 0x10)
+        status["ptc"] = on_off(body[10], 0x08)
+        status["dry"] = on_off(body[10], 0x04)
+        status["comfort_sleep"] = on_off(body[11], 0x01)
+        status["comfort_power_save"] = on_off(body[15], 0x01)
+        status["indoor_temperature"] = (body[12] - 50) / 2
+        status["outdoor_temperature"] = (body[13] - 50) / 2
+        status["crc_valid"] = crc8_854(body, 1, #body - 1) == body[#body]
+    elseif body[1] == 0xB1 then
+        status["prevent_straight_wind"] = body[5] or 1
+    end
+    return JSON.encode({status = status})
+end
@@ -0,0 +1,235 @@
+"""
+Simulated appliances speaking the LAN protocol, on loopback ports, as a
+stand-in for real devices when testing the connections at scale.
+
+A SimulatedDevice answers the 8370 handshake of protocol 3 (the reply
+LocalSecurity.tcp_key expects for the device's token and key), the
+heartbeats, the queries and the control commands, and pushes notify
+frames of its status. The messages are built and parsed by a Lua codec,
+the sample codec by default, a control command takes the whole state of
+the command as real air conditioners do.
+
+    python benchmarks/simulator.py [--count 100] [--port 16000] [--protocol 3] [--notify 10]
+
+serves the devices until interrupted, printing their device ids, tokens and keys.
+"""
+import asyncio
+import argparse
+import random
+from hashlib import sha256
+from common import SAMPLE_LUA, SAMPLE_STATUS, setup_lua_environment
+
+HEARTBEAT_TYPES = (0x1001, 0x0001)
+DEVICE_TYPE = 0xAC
+MSG_SET = 0x02
+MSG_QUERY = 0x03
+MSG_NOTIFY = 0x04
+
+_pool = None
+
+
+def codec_pool():
+    # Apart from the pool of the clients, the clients may be running in another thread
+    global _pool
+    if _pool is None:
+        from core.lua_runtime import LuaRuntimePool
+        _pool = LuaRuntimePool()
+    return _pool
+
+
+def device_credentials(device_id):
+    # Made up from the device id, the clients can derive them as well
+    seed = device_id.to_bytes(8, "little")
+    key = sha256(b"key" + seed).digest()
+    token = sha256(b"token1" + seed).digest() + sha256(b"token2" + seed).digest()
+    return token, key
+
+
+class _DeviceProtocol(asyncio.Protocol):
+    def __init__(self, device):
+        self._device = device
+        self._transport = None
+        self._security = None
+        self._stream = None
+        self._authenticated = False
+
+    def connection_made(self, transport):
+        from core.security import LocalSecurity
+        from core.stream import StreamBuffer
+        self._transport = transport
+        self._security = LocalSecurity()
+        self._stream = StreamBuffer()
+        self._device.connections.add(self)
+        self._device.accepted += 1
+
+    def connection_lost(self, exc):
+        self._device.connections.discard(self)
+
+    def close(self):
+        self._transport.close()
+
+    def data_received(self, data):
+        try:
+            self._stream.feed(data)
+            if self._device.protocol == 3:
+                for packet in self._stream.fetch_8370():
+                    self._packet_8370(packet)
+            else:
+                for packet in self._stream.fetch_v2():
+                    self._packet_v2(bytes(packet))
+        except Exception:
+            # A real device just hangs up on the garbage
+            self._transport.close()
+
+    def _packet_8370(self, packet):
+        from core.security import MSGTYPE_HANDSHAKE_REQUEST
+        if not self._authenticated:
+            if packet[5] & 0xf != MSGTYPE_HANDSHAKE_REQUEST:
+                raise ValueError("Handshake expected")
+            self._handshake(self._security.decode_8370_packet(packet))
+            return
+        self._packet_v2(self._security.decode_8370_packet(packet))
+
+    def _handshake(self, token):
+        from core.security import MSGTYPE_HANDSHAKE_RESPONSE
+        if token != self._device.token:
+            self._transport.write(b"ERROR")
+            return
+        plain = random.randbytes(32)
+        response = self._security.aes_cbc_encrypt(plain, self._device.key) + sha256(plain).digest()
+        # Derive the same session key from the own reply as the client does
+        self._security.tcp_key(response, self._device.key)
+        self._transport.write(self._security.encode_8370(response, MSGTYPE_HANDSHAKE_RESPONSE))
+        self._authenticated = True
+
+    def _packet_v2(self, packet):
+        payload_type = packet[2] + (packet[3] << 8)
+        if payload_type in HEARTBEAT_TYPES:
+            self._device.heartbeats += 1
+            self.send(self._device.builder.build(bytearray([0x00]), msg_type=0))
+        elif len(packet) > 56:
+            message = self._security.aes_decrypt(packet[40:-16])
+            if len(message) > 10:
+                reply = self._device.handle_message(message)
+                if reply is not None:
+                    self.send(self._device.builder.build(reply))
+
+    def send(self, packet):
+        from core.security import MSGTYPE_ENCRYPTED_RESPONSE
+        if self._device.protocol == 3:
+            packet = self._security.encode_8370(bytes(packet), MSGTYPE_ENCRYPTED_RESPONSE)
+        self._transport.write(packet)
+
+
+class SimulatedDevice:
+    def __init__(self, device_id, port, protocol=2, status=None, lua_file=SAMPLE_LUA, host="127.0.0.1"):
+        from core.lua_runtime import MideaCodec
+        from core.packet_builder import PacketBuilder
+        self.device_id = device_id
+        self.port = port
+        self.host = host
+        self.protocol = protocol
+        self.token, self.key = device_credentials(device_id)
+        self.status = dict(SAMPLE_STATUS if status is None else status)
+        self.builder = PacketBuilder(device_id)
+        self.codec = MideaCodec(lua_file, pool=codec_pool())
+        self.connections = set()
+        self.accepted = 0
+        self.heartbeats = 0
+        self.queries = 0
+        self.controls = 0
+        self.notifies = 0
+        self._server = None
+        self._notify_task = None
+
+    def status_message(self, msg_type):
+        message = bytearray.fromhex(self.codec.build_status(self.status))
+        message[9] = msg_type
+        message[-1] = (~ sum(message[1:-1]) + 1) & 0xff
+        return message
+
+    def handle_message(self, message):
+        msg_type = message[9]
+        if msg_type == MSG_QUERY:
+            self.queries += 1
+            return self.status_message(MSG_QUERY)
+        if msg_type == MSG_SET:
+            self.controls += 1
+            status = self.codec.decode_status(message.hex())
+            if status:
+                status.pop("crc_valid", None)
+                self.status.update(status)
+            return self.status_message(MSG_SET)
+        return None
+
+    def notify(self, **status):
+        """
+        Change the status and push it to the connected clients.
+        """
+        self.status.update(status)
+        self.notifies += 1
+        packet = self.builder.build(self.status_message(MSG_NOTIFY))
+        for connection in list(self.connections):
+            connection.send(packet)
+
+    def drop_connections(self):
+        for connection in list(self.connections):
+            connection.close()
+
+    async def _notify_loop(self, interval):
+        while True:
+            # Spread out, the devices don't report all at the same moment
+            await asyncio.sleep(random.uniform(0.5, 1.5) * interval)
+            self.notify(indoor_temperature=random.randint(20, 30))
+
+    async def start(self, notify_interval=None):
+        self._server = await asyncio.get_running_loop().create_server(
+            lambda: _DeviceProtocol(self), self.host, self.port, backlog=16
+        )
+        if notify_interval:
+            self._notify_task = asyncio.get_running_loop().create_task(self._notify_loop(notify_interval))
+
+    async def stop(self):
+        if self._notify_task is not None:
+            self._notify_task.cancel()
+            self._notify_task = None
+        if self._server is not None:
+            self._server.close()
+            self.drop_connections()
+            await self._server.wait_closed()
+            self._server = None
+        self.codec.release()
+
+
+async def start_fleet(count, port, protocol=2, notify_interval=None, first_device_id=150000000000000):
+    devices = [SimulatedDevice(first_device_id + index, port + index, protocol) for index in range(count)]
+    await asyncio.gather(*(device.start(notify_interval) for device in devices))
+    return devices
+
+
+async def serve(args):
+    devices = await start_fleet(args.count, args.port, args.protocol, args.notify)
+    for device in devices:
+        print(f"{device.device_id} 127.0.0.1:{device.port} token {device.token.hex()} key {device.key.hex()}")
+    try:
+        await asyncio.Event().wait()
+    finally:
+        await asyncio.gather(*(device.stop() for device in devices))
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--count", type=int, default=100)
+    parser.add_argument("--port", type=int, default=16000)
+    parser.add_argument("--protocol", type=int, choices=[2, 3], default=3)
+    parser.add_argument("--notify", type=float, default=None)
+    args = parser.parse_args()
+    setup_lua_environment()
+    try:
+        asyncio.run(serve(args))
+    except KeyboardInterrupt:
+        pass
+
+
+if __name__ == "__main__":
+    main()
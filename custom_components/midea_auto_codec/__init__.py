@@ -1,5 +1,7 @@
 import os
+import time
 import base64
+from datetime import timedelta
 import voluptuous as vol
 from importlib import import_module
 from homeassistant.config_entries import ConfigEntry
@@ -9,6 +11,7 @@ try:
 except ImportError:
     from homeassistant.util.json import save_json
 from homeassistant.helpers.typing import ConfigType
+from homeassistant.helpers.event import async_track_time_interval
 from homeassistant.core import (
     HomeAssistant, 
     ServiceCall
@@ -27,12 +30,19 @@ from homeassistant.const import (
     CONF_ENTITIES
 )
 from .core.logger import MideaLogger
-from .core.device import MiedaDevice
+from .core.device import MiedaDevice, ResponseTimeout
+from .core.discover import discovery_cache
+from .core.scheduler import ReconnectPolicy
 from .const import (
     DOMAIN,
     DEVICES,
     CONF_REFRESH_INTERVAL,
+    CONF_COMMAND_WINDOW,
+    CONF_FRAME_SPACING,
+    CONF_RECONNECT_INTERVAL,
+    CONF_RECONNECT_MAX_INTERVAL,
     CONFIG_PATH,
+    CAPTURE_PATH,
     CONF_KEY,
     CONF_ACCOUNT,
     CONF_SN8,
@@ -41,6 +51,17 @@ from .const import (
     CONF_LUA_FILE
 )
 
+SCAN_INTERVAL = timedelta(seconds=60)
+FULL_SCAN_INTERVAL = 900
+SCAN_BACKOFF = "scan_backoff"
+
+# At startup the climate devices connect first, the sensors last
+CONNECT_PRIORITY = {
+    Platform.CLIMATE: 0,
+    Platform.WATER_HEATER: 1,
+    Platform.FAN: 1
+}
+
 ALL_PLATFORM = [
     Platform.BINARY_SENSOR,
     Platform.SENSOR,
@@ -96,6 +117,7 @@ def register_services(hass: HomeAssistant):
     async def async_set_attributes(service: ServiceCall):
         device_id = service.data.get("device_id")
         attributes = service.data.get("attributes")
+        timeout = service.data.get("timeout")
         MideaLogger.debug(f"Service called: set_attributes, device_id: {device_id}, attributes: {attributes}")
         try:
             device: MiedaDevice = hass.data[DOMAIN][DEVICES][device_id].get(CONF_DEVICE)
@@ -103,7 +125,13 @@ def register_services(hass: HomeAssistant):
             MideaLogger.error(f"Failed to call service set_attributes: the device {device_id} isn't exist.")
             return
         if device:
-            device.set_attributes(attributes)
+            if timeout is None:
+                device.set_attributes(attributes)
+                return
+            try:
+                await device.async_set_attributes(attributes, timeout)
+            except ResponseTimeout:
+                MideaLogger.warning(f"The device {device_id} didn't respond to set_attributes in {timeout} seconds")
 
     async def async_send_command(service: ServiceCall):
         device_id = service.data.get("device_id")
@@ -122,13 +150,31 @@ def register_services(hass: HomeAssistant):
         if device:
             device.send_command(cmd_type, cmd_body)
 
+    async def async_capture(service: ServiceCall):
+        device_id = service.data.get("device_id")
+        enable = service.data.get("enable")
+        max_size = service.data.get("max_size")
+        try:
+            device: MiedaDevice = hass.data[DOMAIN][DEVICES][device_id].get(CONF_DEVICE)
+        except KeyError:
+            MideaLogger.error(f"Failed to call service capture: the device {device_id} isn't exist.")
+            return
+        if device:
+            if enable:
+                path = hass.config.path(CAPTURE_PATH, f"{device_id}.cap")
+                await hass.async_add_executor_job(device.start_capture, path, max_size * 1024)
+                MideaLogger.debug(f"Capturing the frames of the device {device_id} to {path}")
+            else:
+                await hass.async_add_executor_job(device.stop_capture)
+
     hass.services.async_register(
         DOMAIN, 
         "set_attributes", 
         async_set_attributes,
         schema=vol.Schema({ 
             vol.Required("device_id"): vol.Coerce(int),
-            vol.Required("attributes"): vol.Any(dict)
+            vol.Required("attributes"): vol.Any(dict),
+            vol.Optional("timeout"): vol.All(vol.Coerce(float), vol.Range(min=0.1, max=60))
         })
     )
     hass.services.async_register(
@@ -139,6 +185,72 @@ def register_services(hass: HomeAssistant):
             vol.Required("cmd_body"): str
         })
     )
+    hass.services.async_register(
+        DOMAIN, "capture", async_capture,
+        schema=vol.Schema({
+            vol.Required("device_id"): vol.Coerce(int),
+            vol.Required("enable"): bool,
+            vol.Optional("max_size", default=4096): vol.All(vol.Coerce(int), vol.Range(min=64, max=65536))
+        })
+    )
+
+
+async def async_scan_devices(hass: HomeAssistant, now=None):
+    """
+    Re-scan the LAN every FULL_SCAN_INTERVAL seconds, or sooner while any
+    device is disconnected, and follow the devices whose IP address changed.
+    While the same devices stay missing the scans back off up to
+    FULL_SCAN_INTERVAL, a device unplugged for good doesn't keep the LAN busy.
+    """
+    devices = hass.data[DOMAIN].get(DEVICES)
+    if not devices:
+        return
+    backoff = hass.data[DOMAIN].setdefault(SCAN_BACKOFF, {
+        "policy": ReconnectPolicy(SCAN_INTERVAL.total_seconds(), FULL_SCAN_INTERVAL),
+        "next": 0,
+        "missing": set()
+    })
+    now = time.monotonic()
+    disconnected = {device_id for device_id, item in devices.items() if not item[CONF_DEVICE].connected}
+    if len(disconnected) == 0:
+        backoff["policy"].reset()
+        backoff["missing"] = set()
+        if now - discovery_cache.last_scan < FULL_SCAN_INTERVAL:
+            return
+    elif disconnected <= backoff["missing"] and now < backoff["next"]:
+        # Only the devices missing in the last scans are still disconnected
+        return
+    # Only the devices replying to this scan, the cache keeps the offline ones for a while
+    scanned = {device["device_id"]: device for device in await discovery_cache.async_scan()}
+    missing = disconnected - scanned.keys()
+    if missing:
+        if not missing <= backoff["missing"]:
+            backoff["policy"].reset()
+        backoff["missing"] = missing
+        backoff["next"] = time.monotonic() + max(SCAN_INTERVAL.total_seconds(), backoff["policy"].next_delay())
+    else:
+        backoff["policy"].reset()
+        backoff["missing"] = set()
+    for config_entry in hass.config_entries.async_entries(DOMAIN):
+        device_id = config_entry.data.get(CONF_DEVICE_ID)
+        if device_id not in devices:
+            continue
+        found = scanned.get(device_id)
+        device: MiedaDevice = devices[device_id][CONF_DEVICE]
+        if found is None:
+            continue
+        if found[CONF_IP_ADDRESS] == device.ip_address:
+            if not device.connected:
+                # It answers at the same address, no need to wait for the backoff
+                device.reconnect_now()
+        else:
+            MideaLogger.debug(
+                f"IP address changed from {device.ip_address} to {found[CONF_IP_ADDRESS]}", device_id=device_id
+            )
+            # The update listener points the device to the new address
+            hass.config_entries.async_update_entry(
+                config_entry, options={**config_entry.options, CONF_IP_ADDRESS: found[CONF_IP_ADDRESS]}
+            )
 
 
 async def update_listener(hass: HomeAssistant, config_entry: ConfigEntry):
@@ -150,12 +262,30 @@ async def update_listener(hass: HomeAssistant, config_entry: ConfigEntry):
         refresh_interval = config_entry.options.get(
             CONF_REFRESH_INTERVAL, None
         )
+        command_window = config_entry.options.get(
+            CONF_COMMAND_WINDOW, None
+        )
+        frame_spacing = config_entry.options.get(
+            CONF_FRAME_SPACING, None
+        )
+        reconnect_interval = config_entry.options.get(
+            CONF_RECONNECT_INTERVAL, None
+        )
+        reconnect_max_interval = config_entry.options.get(
+            CONF_RECONNECT_MAX_INTERVAL, None
+        )
         device: MiedaDevice = hass.data[DOMAIN][DEVICES][device_id][CONF_DEVICE]
         if device:
-            if ip_address is not None:
+            # Any options change calls the listener, only re-point the device on a new address
+            if ip_address is not None and ip_address != device.ip_address:
                 device.set_ip_address(ip_address)
             if refresh_interval is not None:
                 device.set_refresh_interval(refresh_interval)
+            if command_window is not None:
+                device.set_command_window(command_window / 1000)
+            if frame_spacing is not None:
+                device.set_frame_spacing(frame_spacing / 1000)
+            device.set_reconnect_policy(reconnect_interval, reconnect_max_interval)
 
 
 async def async_setup(hass: HomeAssistant, config: ConfigType):
@@ -174,6 +304,11 @@ async def async_setup(hass: HomeAssistant, config: ConfigType):
             fp.write(bit_lua)
 
     register_services(hass)
+
+    async def async_scan(now=None):
+        await async_scan_devices(hass, now)
+
+    async_track_time_interval(hass, async_scan, SCAN_INTERVAL)
     return True
 
 
@@ -190,6 +325,10 @@ async def async_setup_entry(hass: HomeAssistant, config_entry: ConfigEntry):
     if not ip_address:
         ip_address = config_entry.data.get(CONF_IP_ADDRESS)
     refresh_interval = config_entry.options.get(CONF_REFRESH_INTERVAL)
+    command_window = config_entry.options.get(CONF_COMMAND_WINDOW)
+    frame_spacing = config_entry.options.get(CONF_FRAME_SPACING)
+    reconnect_interval = config_entry.options.get(CONF_RECONNECT_INTERVAL)
+    reconnect_max_interval = config_entry.options.get(CONF_RECONNECT_MAX_INTERVAL)
     port = config_entry.data.get(CONF_PORT)
     model = config_entry.data.get(CONF_MODEL)
     protocol = config_entry.data.get(CONF_PROTOCOL)
@@ -217,7 +356,12 @@ async def async_setup_entry(hass: HomeAssistant, config_entry: ConfigEntry):
     )
     if refresh_interval is not None:
         device.set_refresh_interval(refresh_interval)
-    device.open()
+    if command_window is not None:
+        device.set_command_window(command_window / 1000)
+    if frame_spacing is not None:
+        device.set_frame_spacing(frame_spacing / 1000)
+    device.set_reconnect_policy(reconnect_interval, reconnect_max_interval)
+    device.set_update_loop(hass.loop)
     if DOMAIN not in hass.data:
         hass.data[DOMAIN] = {}
     if DEVICES not in hass.data[DOMAIN]:
@@ -239,6 +383,10 @@ async def async_setup_entry(hass: HomeAssistant, config_entry: ConfigEntry):
         hass.data[DOMAIN][DEVICES][device_id]["manufacturer"] = config.get("manufacturer")
         hass.data[DOMAIN][DEVICES][device_id]["rationale"] = config.get("rationale")
         hass.data[DOMAIN][DEVICES][device_id][CONF_ENTITIES] = config.get(CONF_ENTITIES)
+    # Opened once configured, so that the first refresh already sends the queries of the mapping
+    entities = hass.data[DOMAIN][DEVICES][device_id][CONF_ENTITIES] or {}
+    device.set_priority(min((CONNECT_PRIORITY.get(platform, 2) for platform in entities), default=2))
+    device.open()
     for platform in ALL_PLATFORM:
         hass.async_create_task(hass.config_entries.async_forward_entry_setup(
             config_entry, platform))
@@ -51,11 +51,10 @@ class MideaDeviceStatusSensorEntity(MideaBinaryBaseEntity, BinarySensorEntity):
     def extra_state_attributes(self) -> dict:
         return self._device.attributes
 
-    def update_state(self, status):
-        try:
-            self.schedule_update_ha_state()
-        except Exception as e:
-            pass
+    @property
+    def subscribed_attributes(self):
+        # Shows all the attributes of the device
+        return None
 
 
 class MideaBinarySensorEntity(MideaBinaryBaseEntity, BinarySensorEntity):
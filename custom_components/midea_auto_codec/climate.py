@@ -186,8 +186,10 @@ class MideaClimateEntity(MideaEntity, ClimateEntity):
     def turn_aux_heat_off(self) -> None:
         self._set_status_on_off(self._key_aux_heat, False)
 
-    def update_state(self, status):
-        try:
-            self.schedule_update_ha_state()
-        except Exception as e:
-            pass
+    @property
+    def subscribed_attributes(self):
+        return self._collect_attributes(
+            self._key_power, self._key_hvac_modes, self._key_preset_modes, self._key_aux_heat,
+            self._key_swing_modes, self._key_fan_modes, self._key_min_temp, self._key_max_temp,
+            self._key_current_temperature, self._key_target_temperature
+        )
@@ -18,11 +18,15 @@ from homeassistant.const import (
 )
 from . import remove_device_config, load_device_config
 from .core.cloud import get_midea_cloud
-from .core.discover import discover
+from .core.discover import async_discover, discovery_cache
 from .core.device import MiedaDevice
 from .const import (
     DOMAIN,
     CONF_REFRESH_INTERVAL,
+    CONF_COMMAND_WINDOW,
+    CONF_FRAME_SPACING,
+    CONF_RECONNECT_INTERVAL,
+    CONF_RECONNECT_MAX_INTERVAL,
     STORAGE_PATH,
     CONF_ACCOUNT,
     CONF_SERVER,
@@ -184,11 +188,14 @@ class ConfigFlow(config_entries.ConfigFlow, domain=DOMAIN):
                 ip_address = None
                 if self._is_valid_ip_address(user_input[CONF_IP_ADDRESS]):
                     ip_address = user_input[CONF_IP_ADDRESS]
-                discover_devices = discover([self._device[CONF_TYPE]], ip_address)
-                _LOGGER.debug(discover_devices)
-                if discover_devices is None or len(discover_devices) == 0:
-                    return await self.async_step_discover(error="discover_failed")
-                current_device = discover_devices.get(self._device[CONF_DEVICE_ID])
+                current_device = discovery_cache.get(self._device[CONF_DEVICE_ID]) if ip_address is None else None
+                if current_device is None:
+                    async for device in async_discover([self._device[CONF_TYPE]], ip_address):
+                        _LOGGER.debug(device)
+                        discovery_cache.update(device)
+                        if device.get(CONF_DEVICE_ID) == self._device[CONF_DEVICE_ID]:
+                            current_device = device
+                            break
                 if current_device is None:
                     return await self.async_step_discover(error="discover_failed")
                 os.makedirs(self.hass.config.path(STORAGE_PATH), exist_ok=True)
@@ -227,7 +234,7 @@ class ConfigFlow(config_entries.ConfigFlow, domain=DOMAIN):
                             f"Successful to take token and key, token: {key['token']},"
                             f" key: { key['key']}, method: {method}"
                         )
-                        if dm.connect():
+                        if await dm.async_connect():
                             use_token = key["token"]
                             use_key = key["key"]
                             dm.disconnect()
@@ -249,7 +256,7 @@ class ConfigFlow(config_entries.ConfigFlow, domain=DOMAIN):
                         sn8=None,
                         lua_file=None
                     )
-                    if dm.connect():
+                    if await dm.async_connect():
                         dm.disconnect()
                         connected = True
                 if not connected:
@@ -334,6 +341,18 @@ class OptionsFlowHandler(config_entries.OptionsFlow):
         refresh_interval = self._config_entry.options.get(
             CONF_REFRESH_INTERVAL, 30
         )
+        command_window = self._config_entry.options.get(
+            CONF_COMMAND_WINDOW, 0
+        )
+        frame_spacing = self._config_entry.options.get(
+            CONF_FRAME_SPACING, 0
+        )
+        reconnect_interval = self._config_entry.options.get(
+            CONF_RECONNECT_INTERVAL, 5
+        )
+        reconnect_max_interval = self._config_entry.options.get(
+            CONF_RECONNECT_MAX_INTERVAL, 300
+        )
         data_schema = vol.Schema({
             vol.Required(
                 CONF_IP_ADDRESS,
@@ -342,7 +361,23 @@ class OptionsFlowHandler(config_entries.OptionsFlow):
             vol.Required(
                 CONF_REFRESH_INTERVAL,
                 default=refresh_interval
-            ): int
+            ): int,
+            vol.Required(
+                CONF_COMMAND_WINDOW,
+                default=command_window
+            ): vol.All(int, vol.Range(min=0, max=5000)),
+            vol.Required(
+                CONF_FRAME_SPACING,
+                default=frame_spacing
+            ): vol.All(int, vol.Range(min=0, max=5000)),
+            vol.Required(
+                CONF_RECONNECT_INTERVAL,
+                default=reconnect_interval
+            ): vol.All(int, vol.Range(min=1, max=600)),
+            vol.Required(
+                CONF_RECONNECT_MAX_INTERVAL,
+                default=reconnect_max_interval
+            ): vol.All(int, vol.Range(min=1, max=3600))
         })
         return self.async_show_form(
             step_id="configure",
@@ -1,8 +1,13 @@
 DOMAIN = "midea_auto_codec"
 STORAGE_PATH = f".storage/{DOMAIN}/lua"
 CONFIG_PATH = f".storage/{DOMAIN}/config"
+CAPTURE_PATH = f".storage/{DOMAIN}/capture"
 DEVICES = "DEVICES"
 CONF_REFRESH_INTERVAL = "refresh_interval"
+CONF_COMMAND_WINDOW = "command_window"
+CONF_FRAME_SPACING = "frame_spacing"
+CONF_RECONNECT_INTERVAL = "reconnect_interval"
+CONF_RECONNECT_MAX_INTERVAL = "reconnect_max_interval"
 CONF_ACCOUNT = "account"
 CONF_SERVER = "server"
 CONF_HOME = "home"
@@ -0,0 +1,108 @@
+import ast
+import re
+import heapq
+from .logger import MideaLogger
+
+_REFERENCE = re.compile(r"\[([^\[\]]+)\]")
+
+_FUNCTIONS = {
+    "abs": abs,
+    "int": int,
+    "float": float,
+    "round": round,
+    "min": min,
+    "max": max
+}
+
+_ALLOWED_NODES = (
+    ast.Expression, ast.Constant, ast.Name, ast.Load, ast.Call,
+    ast.BinOp, ast.UnaryOp, ast.BoolOp, ast.Compare, ast.IfExp,
+    ast.Add, ast.Sub, ast.Mult, ast.Div, ast.FloorDiv, ast.Mod, ast.Pow,
+    ast.UAdd, ast.USub, ast.Not, ast.And, ast.Or,
+    ast.Eq, ast.NotEq, ast.Lt, ast.LtE, ast.Gt, ast.GtE
+)
+
+
+class CalculateError(Exception):
+    pass
+
+
+class CalculateRule:
+    """
+    One rule of the "calculate" section in the device mapping, such as
+    {"lvalue": "[remaining_time]", "rvalue": "[left_time_hour] * 60 + [left_time_min]"},
+    compiled once into a code object which only sees the referenced attributes.
+    """
+    def __init__(self, lvalue: str, rvalue: str):
+        self.lvalue = lvalue
+        self.rvalue = rvalue
+        target = _REFERENCE.fullmatch(lvalue.strip())
+        if target is None:
+            raise CalculateError(f"lvalue must be a single [attribute]: {lvalue}")
+        self.target = target.group(1)
+        names = {}
+
+        def replace(match):
+            if match.group(1) not in names:
+                names[match.group(1)] = f"_{len(names)}"
+            return names[match.group(1)]
+        try:
+            tree = ast.parse(_REFERENCE.sub(replace, rvalue).strip(), mode="eval")
+        except SyntaxError as e:
+            raise CalculateError(f"Invalid rvalue {rvalue}: {e}")
+        for node in ast.walk(tree):
+            if not isinstance(node, _ALLOWED_NODES):
+                raise CalculateError(f"Unsupported expression {type(node).__name__} in {rvalue}")
+            if isinstance(node, ast.Name) and node.id not in names.values() and node.id not in _FUNCTIONS:
+                raise CalculateError(f"Unknown name {node.id} in {rvalue}")
+            if isinstance(node, ast.Call) and (not isinstance(node.func, ast.Name) or node.func.id not in _FUNCTIONS):
+                raise CalculateError(f"Unsupported function call in {rvalue}")
+        self.inputs = list(names.keys())
+        self._bindings = list(names.items())
+        self._code = compile(tree, f"<calculate {lvalue}>", "eval")
+        self._globals = {"__builtins__": {}, **_FUNCTIONS}
+
+    def evaluate(self, attributes: dict):
+        return eval(self._code, self._globals, {name: attributes[attr] for attr, name in self._bindings})
+
+
+class Calculator:
+    def __init__(self, rules: list):
+        self._rules = []
+        self._index = {}
+        for rule in rules:
+            try:
+                rule = CalculateRule(rule.get("lvalue"), rule.get("rvalue"))
+            except (CalculateError, AttributeError, TypeError) as e:
+                MideaLogger.warning(f"Ignored the calculation {rule}: {e}")
+                continue
+            for attr in rule.inputs:
+                self._index.setdefault(attr, []).append(len(self._rules))
+            self._rules.append(rule)
+
+    @property
+    def rules(self):
+        return self._rules
+
+    @property
+    def targets(self):
+        return {rule.target for rule in self._rules}
+
+    def triggered(self, changed: dict):
+        """
+        Yield the rules depending on the changed attributes, in the order of
+        the mapping. The caller puts each result into changed, so that a rule
+        depending on the result of an earlier rule gets triggered as well.
+        """
+        pending = list({index for attr in changed for index in self._index.get(attr, ())})
+        heapq.heapify(pending)
+        queued = set(pending)
+        while pending:
+            index = heapq.heappop(pending)
+            rule = self._rules[index]
+            yield rule
+            if rule.target in changed:
+                for following in self._index.get(rule.target, ()):
+                    if following > index and following not in queued:
+                        queued.add(following)
+                        heapq.heappush(pending, following)
@@ -0,0 +1,178 @@
+import os
+import queue
+import struct
+import threading
+import time
+from collections import namedtuple
+from .logger import MideaLogger
+from .security import LocalSecurity
+from .stream import StreamBuffer
+
+# Every capture file starts with a header, then the frames follow, each one
+# a record header and the data
+CAPTURE_MAGIC = b"MCAP"
+CAPTURE_VERSION = 1
+FILE_HEADER = struct.Struct("<4sBBBQ")
+RECORD_HEADER = struct.Struct("<dBBI")
+
+DIRECTION_RECEIVED = 0
+DIRECTION_SENT = 1
+
+# The bytes as they went over the socket, 5A5A or 8370 packets
+KIND_WIRE = 0
+# The decrypted AA message, what the lua script sees
+KIND_MESSAGE = 1
+
+CapturedFrame = namedtuple("CapturedFrame", ["timestamp", "direction", "kind", "data"])
+CaptureInfo = namedtuple("CaptureInfo", ["protocol", "device_type", "device_id"])
+
+
+class CaptureError(Exception):
+    pass
+
+
+class FrameRecorder:
+    """
+    Appends the frames of one device to a binary capture file, a capture of
+    the same device already there is continued, any other file is rotated
+    away first. The file is rotated to path.1, path.2 ... once it grows over
+    max_bytes, only the newest backups are kept. record() only queues the frame, the file is
+    written and rotated by a thread of the recorder, off the engine loop.
+    """
+    def __init__(self, path, protocol, device_type, device_id, max_bytes=4 * 1024 * 1024, backups=3):
+        self._path = path
+        self._header = FILE_HEADER.pack(CAPTURE_MAGIC, CAPTURE_VERSION, protocol, device_type, device_id)
+        self._max_bytes = max_bytes
+        self._backups = backups
+        self._queue = queue.SimpleQueue()
+        self._closed = False
+        self._file = None
+        self._size = 0
+        self._open()
+        self._writer = threading.Thread(target=self._write_loop, name="MideaCapture", daemon=True)
+        self._writer.start()
+
+    @property
+    def path(self):
+        return self._path
+
+    def _open(self):
+        os.makedirs(os.path.dirname(os.path.abspath(self._path)), exist_ok=True)
+        if os.path.exists(self._path):
+            with open(self._path, "rb") as fp:
+                header = fp.read(len(self._header))
+            if header and header != self._header:
+                self._shift_backups()
+        self._file = open(self._path, "ab")
+        self._size = self._file.tell()
+        if self._size == 0:
+            self._file.write(self._header)
+            self._size = len(self._header)
+
+    def _shift_backups(self):
+        for index in range(self._backups - 1, 0, -1):
+            if os.path.exists(f"{self._path}.{index}"):
+                os.replace(f"{self._path}.{index}", f"{self._path}.{index + 1}")
+        if self._backups > 0:
+            os.replace(self._path, f"{self._path}.1")
+        elif os.path.exists(self._path):
+            os.remove(self._path)
+
+    def _rotate(self):
+        self._file.close()
+        self._shift_backups()
+        self._open()
+
+    def _write_loop(self):
+        try:
+            while (frame := self._queue.get()) is not None:
+                timestamp, direction, kind, data = frame
+                if self._size > self._max_bytes:
+                    self._rotate()
+                self._file.write(RECORD_HEADER.pack(timestamp, direction, kind, len(data)))
+                self._file.write(data)
+                self._size += RECORD_HEADER.size + len(data)
+        except OSError as e:
+            # Stop queueing frames that can't be written any more
+            self._closed = True
+            MideaLogger.warning(f"Capture to {self._path} stopped: {repr(e)}")
+        finally:
+            if not self._file.closed:
+                self._file.close()
+
+    def record(self, direction, kind, data):
+        if not self._closed:
+            self._queue.put((time.time(), direction, kind, bytes(data)))
+
+    def close(self, wait=True):
+        """
+        Stop recording, the frames queued so far are still written. With wait
+        the call blocks until the file is closed.
+        """
+        if not self._closed:
+            self._closed = True
+            self._queue.put(None)
+        if wait:
+            self._writer.join()
+
+
+def read_capture_info(path) -> CaptureInfo:
+    with open(path, "rb") as fp:
+        return _read_header(fp)
+
+
+def _read_header(fp):
+    header = fp.read(FILE_HEADER.size)
+    if len(header) < FILE_HEADER.size:
+        raise CaptureError(f"Truncated capture header")
+    magic, version, protocol, device_type, device_id = FILE_HEADER.unpack(header)
+    if magic != CAPTURE_MAGIC or version != CAPTURE_VERSION:
+        raise CaptureError(f"Not a capture file or unsupported version {version}")
+    return CaptureInfo(protocol, device_type, device_id)
+
+
+def read_capture(path, direction=None, kind=None):
+    """
+    Yield the CapturedFrames of a capture file, optionally only those of one
+    direction and kind. A frame cut off at the end of the file is ignored.
+    """
+    with open(path, "rb") as fp:
+        _read_header(fp)
+        while len(header := fp.read(RECORD_HEADER.size)) == RECORD_HEADER.size:
+            timestamp, frame_direction, frame_kind, length = RECORD_HEADER.unpack(header)
+            data = fp.read(length)
+            if len(data) < length:
+                break
+            if (direction is None or frame_direction == direction) and (kind is None or frame_kind == kind):
+                yield CapturedFrame(timestamp, frame_direction, frame_kind, data)
+
+
+def replay_wire(path):
+    """
+    Feed the received wire bytes of a protocol 2 capture through the stream
+    parser and the local decryption, yield the AA messages as the device
+    would see them. Protocol 3 sessions can't be decrypted offline, replay
+    their KIND_MESSAGE frames instead.
+    """
+    info = read_capture_info(path)
+    if info.protocol == 3:
+        raise CaptureError("The wire frames of protocol 3 are encrypted with the session key")
+    security = LocalSecurity()
+    stream = StreamBuffer()
+    for frame in read_capture(path, DIRECTION_RECEIVED, KIND_WIRE):
+        stream.feed(frame.data)
+        for message in stream.fetch_v2():
+            payload_type = message[2] + (message[3] << 8)
+            if payload_type in [0x1001, 0x0001] or len(message) <= 56:
+                continue
+            if (message[4] + (message[5] << 8) - 56) % 16 == 0:
+                yield security.aes_decrypt(bytes(message[40:-16]))
+
+
+def replay_messages(path, codec):
+    """
+    Decode the received AA messages of a capture with the codec (MideaCodec),
+    yield (frame, decoded status).
+    """
+    for frame in read_capture(path, DIRECTION_RECEIVED, KIND_MESSAGE):
+        yield frame, codec.decode_status(frame.data.hex())
@@ -1,12 +1,25 @@
+import asyncio
 import threading
-import socket
 import time
+from collections import ChainMap, deque
 from enum import IntEnum
 from .security import LocalSecurity, MSGTYPE_HANDSHAKE_REQUEST, MSGTYPE_ENCRYPTED_REQUEST
 from .packet_builder import PacketBuilder
 from .lua_runtime import MideaCodec
-from .message import MessageQuestCustom
-from .logger import MideaLogger
+from .calculate import Calculator
+from .message import MessageQuestCustom, MessageType
+from .stream import StreamBuffer
+from .capture import (
+    FrameRecorder,
+    DIRECTION_RECEIVED,
+    DIRECTION_SENT,
+    KIND_WIRE,
+    KIND_MESSAGE
+)
+from .scheduler import RefreshScheduler, ReconnectPolicy
+from .metrics import DeviceMetrics
+from .engine import MideaEngine
+from .logger import MideaLogger, LazyHex
 
 
 class AuthException(Exception):
@@ -21,13 +34,31 @@ class RefreshFailed(Exception):
     pass
 
 
+class ResponseTimeout(Exception):
+    pass
+
+
 class ParseMessageResult(IntEnum):
     SUCCESS = 0
     PADDING = 1
     ERROR = 99
 
 
-class MiedaDevice(threading.Thread):
+class DeviceProtocol(asyncio.Protocol):
+    def __init__(self, device):
+        self._device = device
+
+    def connection_made(self, transport):
+        self._device._connection_made(self)
+
+    def data_received(self, data):
+        self._device._data_received(self, data)
+
+    def connection_lost(self, exc):
+        self._device._connection_lost(self, exc)
+
+
+class MiedaDevice:
     def __init__(self,
                  name: str,
                  device_id: int,
@@ -41,21 +72,43 @@ class MiedaDevice(threading.Thread):
                  subtype: int | None,
                  sn: str | None,
                  sn8: str | None,
-                 lua_file: str | None):
-        threading.Thread.__init__(self)
-        self._socket = None
+                 lua_file: str | None,
+                 engine: MideaEngine | None = None):
+        self._engine = engine if engine is not None else MideaEngine.instance()
+        self._transport = None
+        self._connection = None
+        self._handshake = None
+        self._lost = None
+        self._run_task = None
+        self._refresh_timer = None
+        self._heartbeat_timer = None
+        self._last_received = 0
+        self._last_status = 0
+        self._auth_validated = False
+        self._auth_failures = 0
+        self._auth_failures_total = 0
+        self._handshakes = 0
+        self._handshake_time = None
+        self._handshake_total = 0
+        self._metrics = DeviceMetrics()
         self._ip_address = ip_address
         self._port = port
         self._security = LocalSecurity()
+        self._packet_builder = PacketBuilder(device_id)
         self._token = bytes.fromhex(token) if token else None
         self._key = bytes.fromhex(key) if key else None
-        self._buffer = b""
+        self._stream = StreamBuffer()
+        self._capture = None
         self._device_name = name
         self._device_id = device_id
         self._device_type = device_type
         self._protocol = protocol
         self._model = model
         self._updates = []
+        self._update_index = {}
+        self._update_loop = None
+        self._pending_updates = {}
+        self._updates_lock = threading.Lock()
         self._is_run = False
         self._subtype = subtype
         self._sn = sn
@@ -67,12 +120,27 @@ class MiedaDevice(threading.Thread):
             "subtype": subtype
         }
         self._refresh_interval = 30
+        self._scheduler = RefreshScheduler(self._refresh_interval)
         self._heartbeat_interval = 10
+        self._heartbeat_timeout = 120
+        self._reconnect = ReconnectPolicy()
+        self._priority = 0
+        self._wake = None
+        self._command_window = 0
+        self._pending_control = {}
+        self._pending_lock = threading.Lock()
+        self._control_timer = None
+        self._waiters = []
         self._connected = False
-        self._queries = [{}]
+        self._queries = [[{}, None, 0]]
+        self._frame_spacing = 0
+        self._send_queue = deque()
+        self._control_queue = deque()
+        self._send_timer = None
+        self._last_sent = 0
         self._centralized = []
-        self._calculate_get = []
-        self._calculate_set = []
+        self._calculate_get = Calculator([])
+        self._calculate_set = Calculator([])
         self._lua_runtime = MideaCodec(lua_file, sn=sn, subtype=subtype) if lua_file is not None else None
 
     @property
@@ -111,11 +179,74 @@ class MiedaDevice(threading.Thread):
     def connected(self):
         return self._connected
 
+    @property
+    def ip_address(self):
+        return self._ip_address
+
+    @property
+    def handshake_stats(self):
+        return {
+            "handshakes": self._handshakes,
+            "failures": self._auth_failures_total,
+            "consecutive_failures": self._auth_failures,
+            "last_ms": None if self._handshake_time is None else round(self._handshake_time * 1000, 1),
+            "average_ms": round(self._handshake_total * 1000 / self._handshakes, 1) if self._handshakes else None
+        }
+
+    @property
+    def metrics(self) -> DeviceMetrics:
+        return self._metrics
+
+    @property
+    def capture(self):
+        return self._capture
+
+    def start_capture(self, path, max_bytes=4 * 1024 * 1024):
+        # Blocking, opens the capture file
+        self.stop_capture()
+        self._capture = FrameRecorder(
+            path, self._protocol, self._device_type, self._device_id, max_bytes=max_bytes
+        )
+
+    def stop_capture(self, wait=True):
+        capture = self._capture
+        self._capture = None
+        if capture is not None:
+            capture.close(wait)
+
     def set_refresh_interval(self, refresh_interval):
         self._refresh_interval = refresh_interval
+        self._scheduler.interval = refresh_interval
+        self._engine.call_soon(self._schedule_refresh)
+
+    def set_priority(self, priority):
+        """
+        The order of connecting when many devices are waiting, lower first.
+        """
+        self._priority = priority
+
+    def set_reconnect_policy(self, base=None, cap=None):
+        self._reconnect.configure(base, cap)
+
+    def set_command_window(self, command_window):
+        self._command_window = command_window
+
+    def set_frame_spacing(self, frame_spacing):
+        self._frame_spacing = frame_spacing
 
     def set_queries(self, queries: list):
-        self._queries = queries
+        """
+        A query is sent at every refresh, or wrapped as
+        {"query": {"query_type": "..."}, "interval": 3600} it is sent
+        at most once every interval seconds.
+        """
+        items = []
+        for query in queries:
+            if isinstance(query, dict) and "query" in query and "interval" in query:
+                items.append([query["query"], query["interval"], 0])
+            else:
+                items.append([query, None, 0])
+        self._queries = items
 
     def set_centralized(self, centralized: list):
         self._centralized = centralized
@@ -123,117 +254,291 @@ class MiedaDevice(threading.Thread):
     def set_calculate(self, calculate: dict):
         values_get = calculate.get("get")
         values_set = calculate.get("set")
-        self._calculate_get = values_get if values_get else []
-        self._calculate_set = values_set if values_set else []
+        self._calculate_get = Calculator(values_get if values_get else [])
+        self._calculate_set = Calculator(values_set if values_set else [])
 
     def get_attribute(self, attribute):
         return self._attributes.get(attribute)
 
     def set_attribute(self, attribute, value):
-        if attribute in self._attributes.keys():
-            new_status = {}
-            for attr in self._centralized:
-                new_status[attr] = self._attributes.get(attr)
-            new_status[attribute] = value
-            if set_cmd := self._lua_runtime.build_control(new_status):
-                self._build_send(set_cmd)
+        self.set_attributes({attribute: value})
 
     def set_attributes(self, attributes):
+        if self._command_window <= 0:
+            # Built in the engine loop, the Lua runtime shared with other devices may be busy decoding
+            self._engine.call_soon(self._send_control, dict(attributes))
+            return
+        # Merge the calls within the window into one control frame, the latest value wins
+        with self._pending_lock:
+            schedule = len(self._pending_control) == 0
+            self._pending_control.update(attributes)
+        if schedule:
+            self._engine.call_soon(self._schedule_control)
+
+    def _schedule_control(self):
+        if self._control_timer is None:
+            self._control_timer = asyncio.get_running_loop().call_later(
+                self._command_window, self._flush_control
+            )
+
+    def _flush_control(self):
+        self._control_timer = None
+        with self._pending_lock:
+            attributes = self._pending_control
+            self._pending_control = {}
+        if len(attributes) > 0 and self._lua_runtime is not None:
+            MideaLogger.debug(f"Coalesced control: {attributes}", device_id=self._device_id)
+            self._send_control(attributes)
+
+    def _send_control(self, attributes):
+        if set_cmd := self._build_control(attributes):
+            self._build_send(set_cmd, control=True)
+            self._controlled()
+
+    def _controlled(self):
+        self._scheduler.controlled()
+        self._engine.call_soon(self._schedule_refresh)
+
+    def _build_control(self, attributes):
         new_status = {}
         for attr in self._centralized:
             new_status[attr] = self._attributes.get(attr)
-        has_new = False
+        requested = {}
         for attribute, value in attributes.items():
             if attribute in self._attributes.keys():
-                has_new = True
-                new_status[attribute] = value
-        if has_new:
-            if set_cmd := self._lua_runtime.build_control(new_status):
-                self._build_send(set_cmd)
+                requested[attribute] = value
+        if len(requested) > 0:
+            self._calculate_control(requested)
+            new_status.update(requested)
+            codec = self._lua_runtime
+            return codec.build_control(new_status) if codec is not None else None
+        return None
+
+    async def async_set_attributes(self, attributes, timeout=5):
+        """
+        Send the attributes in one control frame at once and wait for the reply
+        of the device, return the decoded status of the reply.
+        Raise ResponseTimeout if the device doesn't reply within timeout seconds.
+        """
+        return await self._engine.async_run_coroutine(self._async_control(attributes, timeout))
+
+    async def _async_control(self, attributes, timeout):
+        # The pending coalesced attributes go out in the same frame
+        if self._control_timer is not None:
+            self._control_timer.cancel()
+            self._control_timer = None
+        with self._pending_lock:
+            attributes = {**self._pending_control, **attributes}
+            self._pending_control = {}
+        if self._lua_runtime is None or not (set_cmd := self._build_control(attributes)):
+            return None
+        waiter = self._add_waiter(bytes.fromhex(set_cmd))
+        self._build_send(set_cmd, control=True)
+        self._controlled()
+        try:
+            return await asyncio.wait_for(waiter[2], timeout=timeout)
+        except asyncio.TimeoutError:
+            raise ResponseTimeout(f"No response to {set_cmd.lower()} in {timeout} seconds")
+        finally:
+            if waiter in self._waiters:
+                self._waiters.remove(waiter)
+
+    def _add_waiter(self, request):
+        waiter = (request[9], request[10] if len(request) > 11 else None,
+                  asyncio.get_running_loop().create_future())
+        self._waiters.append(waiter)
+        return waiter
+
+    def _resolve_waiter(self, response, status):
+        """
+        Hand a reply to the earliest request of the same message type,
+        preferring the request with the same body type, notifications are
+        sent by the device on its own and answer nothing.
+        """
+        if len(response) < 11 or response[9] in (MessageType.notify1, MessageType.notify2):
+            return
+        candidates = [waiter for waiter in self._waiters if waiter[0] == response[9] and not waiter[2].done()]
+        if len(candidates) == 0:
+            return
+        waiter = next((waiter for waiter in candidates if waiter[1] == response[10]), candidates[0])
+        self._waiters.remove(waiter)
+        waiter[2].set_result(status)
+
+    def _cancel_waiters(self):
+        for waiter in self._waiters:
+            if not waiter[2].done():
+                waiter[2].cancel()
+        self._waiters = []
 
     def set_ip_address(self, ip_address):
         MideaLogger.debug(f"Update IP address to {ip_address}")
         self._ip_address = ip_address
-        self.close_socket()
+        self.disconnect()
+        self.reconnect_now()
+
+    def reconnect_now(self):
+        """
+        Cut the reconnect backoff short, when the device is known to be back.
+        """
+        self._engine.call_soon(self._wake_up)
+
+    def _wake_up(self):
+        self._reconnect.reset()
+        if self._wake is not None:
+            self._wake.set()
+
+    async def _wait_reconnect(self, delay):
+        self._wake = asyncio.Event()
+        try:
+            await asyncio.wait_for(self._wake.wait(), timeout=delay)
+        except asyncio.TimeoutError:
+            pass
+        finally:
+            self._wake = None
 
     def send_command(self, cmd_type, cmd_body: bytearray):
         cmd = MessageQuestCustom(self._device_type, cmd_type, cmd_body)
         try:
-            self._build_send(cmd.serialize().hex())
-        except socket.error as e:
+            self._build_send(cmd.serialize().hex(), control=True)
+        except OSError as e:
             MideaLogger.debug(
                 f"Interface send_command failure, {repr(e)}, "
                 f"cmd_type: {cmd_type}, cmd_body: {cmd_body.hex()}",
-                self._device_id
+                device_id=self._device_id
             )
 
-    def register_update(self, update):
-        self._updates.append(update)
+    def register_update(self, update, attributes=None):
+        """
+        Call update with the changed status when any of attributes changed,
+        or on every change if attributes is None. The connection state goes
+        to every update. Replaced rather than modified, the updates may be
+        running in the engine thread meanwhile.
+        """
+        if attributes is None:
+            self._updates = self._updates + [update]
+        else:
+            index = {attr: list(updates) for attr, updates in self._update_index.items()}
+            for attr in attributes:
+                index.setdefault(attr, []).append(update)
+            self._update_index = index
+
+    def set_update_loop(self, loop: asyncio.AbstractEventLoop):
+        """
+        Call the updates in loop instead of the engine thread, the status of
+        the frames received before the loop gets to them is merged into one call.
+        """
+        self._update_loop = loop
+
+    def unregister_update(self, update):
+        self._updates = [item for item in self._updates if item != update]
+        index = {}
+        for attr, updates in self._update_index.items():
+            if updates := [item for item in updates if item != update]:
+                index[attr] = updates
+        self._update_index = index
 
     def connect(self, refresh=False):
+        return self._engine.run_coroutine(self._async_connect(refresh)).result()
+
+    async def async_connect(self, refresh=False):
+        return await self._engine.async_run_coroutine(self._async_connect(refresh))
+
+    async def _async_connect(self, refresh=False):
+        loop = asyncio.get_running_loop()
         try:
-            self._socket = socket.socket(socket.AF_INET, socket.SOCK_STREAM)
-            self._socket.settimeout(10)
-            MideaLogger.debug(f"Connecting to {self._ip_address}:{self._port}", self._device_id)
-            self._socket.connect((self._ip_address, self._port))
-            MideaLogger.debug(f"Connected", self._device_id)
+            MideaLogger.debug(f"Connecting to {self._ip_address}:{self._port}", device_id=self._device_id)
+            lost = self._lost = asyncio.Event()
+            self._transport, _ = await asyncio.wait_for(
+                loop.create_connection(lambda: DeviceProtocol(self), self._ip_address, self._port),
+                timeout=10
+            )
+            if lost.is_set():
+                # Disconnected while connecting, there was no transport to close then
+                raise ConnectionError("Disconnected while connecting")
+            MideaLogger.debug(f"Connected", device_id=self._device_id)
             if self._protocol == 3:
-                self._authenticate()
-            MideaLogger.debug(f"Authentication success", self._device_id)
+                await self._authenticate()
+            MideaLogger.debug(f"Authentication success", device_id=self._device_id)
+            self._metrics.connected()
             self._device_connected(True)
             if refresh:
-                self._refresh_status()
+                if self._state_fresh():
+                    MideaLogger.debug(f"The last status is still fresh, skip the refresh", device_id=self._device_id)
+                else:
+                    self._refresh_status(force=True)
             return True
-        except socket.timeout:
-            MideaLogger.debug(f"Connection timed out", self._device_id)
-        except socket.error:
-            MideaLogger.debug(f"Connection error", self._device_id)
-        except AuthException:
-            MideaLogger.debug(f"Authentication failed", self._device_id)
+        except asyncio.TimeoutError:
+            MideaLogger.debug(f"Connection timed out", device_id=self._device_id)
+        except OSError:
+            MideaLogger.debug(f"Connection error", device_id=self._device_id)
+        except AuthException as e:
+            MideaLogger.debug(f"Authentication failed {e}", device_id=self._device_id)
+            self._auth_failed()
         except ResponseException:
-            MideaLogger.debug(f"Unexpected response received", self._device_id)
+            MideaLogger.debug(f"Unexpected response received", device_id=self._device_id)
         except RefreshFailed:
-            MideaLogger.debug(f"Refresh status is timed out", self._device_id)
+            MideaLogger.debug(f"Refresh status is timed out", device_id=self._device_id)
         except Exception as e:
             MideaLogger.error(f"Unknown error: {e.__traceback__.tb_frame.f_globals['__file__']}, "
                               f"{e.__traceback__.tb_lineno}, {repr(e)}")
         if refresh:
             self._device_connected(False)
-        self._socket = None
+        self._close_transport()
         return False
 
-    
     def disconnect(self):
-        self._buffer = b""
-        if self._socket:
-            self._socket.close()
-            self._socket = None
-
-    @staticmethod
-    def _fetch_v2_message(msg):
-        result = []
-        while len(msg) > 0:
-            factual_msg_len = len(msg)
-            if factual_msg_len < 6:
-                break
-            alleged_msg_len = msg[4] + (msg[5] << 8)
-            if factual_msg_len >= alleged_msg_len:
-                result.append(msg[:alleged_msg_len])
-                msg = msg[alleged_msg_len:]
-            else:
-                break
-        return result, msg
-
-    def _authenticate(self):
+        self._engine.call_soon(self._close_transport)
+
+    def _close_transport(self):
+        self._stream.clear()
+        self._clear_queue()
+        connection, self._connection = self._connection, None
+        transport, self._transport = self._transport, None
+        if transport is not None:
+            transport.close()
+        if connection is not None:
+            self._metrics.disconnected()
+        if self._handshake is not None and not self._handshake.done():
+            self._handshake.set_exception(ConnectionError("Connection closed"))
+        if self._lost is not None:
+            self._lost.set()
+
+    async def _authenticate(self):
         request = self._security.encode_8370(
             self._token, MSGTYPE_HANDSHAKE_REQUEST)
         MideaLogger.debug(f"Handshaking")
-        self._socket.send(request)
-        response = self._socket.recv(512)
+        started = time.monotonic()
+        self._handshake = asyncio.get_running_loop().create_future()
+        try:
+            self._transport.write(request)
+            response = await asyncio.wait_for(self._handshake, timeout=10)
+        finally:
+            self._handshake = None
         if len(response) < 20:
             raise AuthException()
         response = response[8: 72]
-        self._security.tcp_key(response, self._key)
+        try:
+            self._security.tcp_key(response, self._key)
+        except Exception as e:
+            raise AuthException(repr(e))
+        elapsed = time.monotonic() - started
+        self._handshakes += 1
+        self._handshake_time = elapsed
+        self._handshake_total += elapsed
+        self._auth_validated = True
+        self._auth_failures = 0
+        MideaLogger.debug(f"Handshake took {elapsed * 1000:.0f}ms", device_id=self._device_id)
+
+    def _auth_failed(self):
+        self._auth_failures += 1
+        self._auth_failures_total += 1
+        if not self._auth_validated and self._auth_failures == 3:
+            # A pair that never worked won't start working by retrying
+            MideaLogger.warning(f"The token and key were rejected {self._auth_failures} times, "
+                                f"the device may need to be configured again", device_id=self._device_id)
+
+    def _state_fresh(self):
+        return self._last_status > 0 and time.monotonic() - self._last_status < self._refresh_interval
 
     def _send_message(self, data):
         if self._protocol == 3:
@@ -242,8 +547,11 @@ class MiedaDevice(threading.Thread):
             self._send_message_v2(data)
 
     def _send_message_v2(self, data):
-        if self._socket is not None:
-            self._socket.send(data)
+        if self._transport is not None:
+            if (capture := self._capture) is not None:
+                capture.record(DIRECTION_SENT, KIND_WIRE, data)
+            self._metrics.data_sent(len(data))
+            self._transport.write(data)
         else:
             MideaLogger.debug(f"Command send failure, device disconnected, data: {data.hex()}")
 
@@ -251,27 +559,66 @@ class MiedaDevice(threading.Thread):
         data = self._security.encode_8370(data, msg_type)
         self._send_message_v2(data)
 
-    def _build_send(self, cmd: str):
-        MideaLogger.debug(f"Sending: {cmd.lower()}")
+    def _build_send(self, cmd: str, control=False):
+        MideaLogger.debug("Sending: %s", cmd, device_id=self._device_id)
         bytes_cmd = bytes.fromhex(cmd)
-        msg = PacketBuilder(self._device_id, bytes_cmd).finalize()
-        self._send_message(msg)
-
-    def _refresh_status(self):
-        for query in self._queries:
-            if query_cmd := self._lua_runtime.build_query(query):
+        if (capture := self._capture) is not None:
+            capture.record(DIRECTION_SENT, KIND_MESSAGE, bytes_cmd)
+        if len(bytes_cmd) > 9:
+            self._metrics.request(bytes_cmd[9])
+        msg = self._packet_builder.build(bytes_cmd)
+        self._engine.call_soon(self._enqueue, msg, control)
+
+    def _enqueue(self, msg, control=False):
+        # The control frames go ahead of the queued queries
+        (self._control_queue if control else self._send_queue).append(msg)
+        if self._send_timer is None:
+            self._drain_queue()
+
+    def _drain_queue(self):
+        self._send_timer = None
+        while self._control_queue or self._send_queue:
+            delay = self._last_sent + self._frame_spacing - time.monotonic()
+            if delay > 0:
+                # Slow Wi-Fi modules drop the frames sent back-to-back
+                self._send_timer = asyncio.get_running_loop().call_later(delay, self._drain_queue)
+                return
+            queue = self._control_queue if self._control_queue else self._send_queue
+            self._send_message(queue.popleft())
+            self._last_sent = time.monotonic()
+
+    def _clear_queue(self):
+        if self._send_timer is not None:
+            self._send_timer.cancel()
+            self._send_timer = None
+        self._send_queue.clear()
+        self._control_queue.clear()
+
+    def _refresh_status(self, force=False):
+        self._scheduler.polled()
+        now = time.monotonic()
+        for item in self._queries:
+            query, interval, last_sent = item
+            if not force and interval is not None and now - last_sent < interval:
+                continue
+            if (codec := self._lua_runtime) is None:
+                return
+            if query_cmd := codec.build_query(query):
+                item[2] = now
                 self._build_send(query_cmd)
 
     def _parse_message(self, msg):
+        self._stream.feed(msg)
         if self._protocol == 3:
-            messages, self._buffer = self._security.decode_8370(self._buffer + msg)
+            messages = [self._security.decode_8370_packet(packet) for packet in self._stream.fetch_8370()]
         else:
-            messages, self._buffer = self.fetch_v2_message(self._buffer + msg)
+            messages = self._stream.fetch_v2()
         if len(messages) == 0:
             return ParseMessageResult.PADDING
         for message in messages:
             if message == b"ERROR":
                 return ParseMessageResult.ERROR
+            self._metrics.frame_received()
             payload_len = message[4] + (message[5] << 8) - 56
             payload_type = message[2] + (message[3] << 8)
             if payload_type in [0x1001, 0x0001]:
@@ -281,9 +628,23 @@ class MiedaDevice(threading.Thread):
                 cryptographic = message[40:-16]
                 if payload_len % 16 == 0:
                     decrypted = self._security.aes_decrypt(cryptographic)
-                    MideaLogger.debug(f"Received: {decrypted.hex().lower()}")
-                    if status := self._lua_runtime.decode_status(decrypted.hex()):
-                        MideaLogger.debug(f"Decoded: {status}")
+                    MideaLogger.debug("Received: %s", LazyHex(decrypted), device_id=self._device_id)
+                    if (capture := self._capture) is not None:
+                        capture.record(DIRECTION_RECEIVED, KIND_MESSAGE, decrypted)
+                    if len(decrypted) > 10 and decrypted[9] in (MessageType.notify1, MessageType.notify2):
+                        self._scheduler.notified()
+                    if (codec := self._lua_runtime) is None:
+                        continue
+                    started = time.perf_counter()
+                    status = codec.decode_status(decrypted.hex())
+                    self._metrics.decoded(time.perf_counter() - started, status is not None)
+                    if len(decrypted) > 9:
+                        self._metrics.response(decrypted[9])
+                    if self._waiters:
+                        self._resolve_waiter(decrypted, status)
+                    if status:
+                        MideaLogger.debug("Decoded: %s", status, device_id=self._device_id)
+                        self._last_status = time.monotonic()
                         new_status = {}
                         for single in status.keys():
                             value = status.get(single)
@@ -291,37 +652,41 @@ class MiedaDevice(threading.Thread):
                                 self._attributes[single] = value
                                 new_status[single] = value
                         if len(new_status) > 0:
-                            for c in self._calculate_get:
-                                lvalue = c.get("lvalue")
-                                rvalue = c.get("rvalue")
-                                if lvalue and rvalue:
-                                    calculate = False
-                                    for s, v in new_status.items():
-                                        if rvalue.find(f"[{s}]") >= 0:
-                                            calculate = True
-                                            break
-                                    if calculate:
-                                        calculate_str1 = \
-                                            (f"{lvalue.replace('[', 'self._attributes[')} = "
-                                             f"{rvalue.replace('[', 'self._attributes[')}") \
-                                            .replace("[","[\"").replace("]","\"]")
-                                        calculate_str2 = \
-                                            (f"{lvalue.replace('[', 'new_status[')} = "
-                                             f"{rvalue.replace('[', 'self._attributes[')}") \
-                                            .replace("[","[\"").replace("]","\"]")
-                                        try:
-                                            exec(calculate_str1)
-                                            exec(calculate_str2)
-                                        except Exception:
-                                            MideaLogger.warning(
-                                                f"Calculation Error: {lvalue} = {rvalue}", self._device_id
-                                            )
+                            self._calculate(new_status)
                             self._update_all(new_status)
         return ParseMessageResult.SUCCESS
 
+    def _calculate(self, new_status):
+        for rule in self._calculate_get.triggered(new_status):
+            try:
+                value = rule.evaluate(self._attributes)
+            except Exception:
+                MideaLogger.warning(
+                    f"Calculation Error: {rule.lvalue} = {rule.rvalue}", device_id=self._device_id
+                )
+                continue
+            self._attributes[rule.target] = value
+            new_status[rule.target] = value
+
+    def _calculate_control(self, requested):
+        values = ChainMap(requested, self._attributes)
+        consumed = set()
+        for rule in self._calculate_set.triggered(requested):
+            try:
+                requested[rule.target] = rule.evaluate(values)
+                consumed.update(rule.inputs)
+            except Exception:
+                MideaLogger.warning(
+                    f"Calculation Error: {rule.lvalue} = {rule.rvalue}", device_id=self._device_id
+                )
+        # The attributes made by calculate.get are unknown to the device, don't send them
+        for attr in consumed & self._calculate_get.targets:
+            requested.pop(attr, None)
+
     def _send_heartbeat(self):
-        msg = PacketBuilder(self._device_id, bytearray([0x00])).finalize(msg_type=0)
-        self._send_message(msg)
+        msg = self._packet_builder.build(bytearray([0x00]), msg_type=0)
+        # Through the queue as well, spaced from the other frames
+        self._enqueue(msg)
 
     def _device_connected(self, connected=True):
         self._connected = connected
@@ -329,68 +694,158 @@ class MiedaDevice(threading.Thread):
         self._update_all(status)
 
     def _update_all(self, status):
-        MideaLogger.debug(f"Status update: {status}")
-        for update in self._updates:
+        MideaLogger.debug("Status update: %s", status, device_id=self._device_id)
+        if self._update_loop is None:
+            self._deliver_updates(status)
+            return
+        with self._updates_lock:
+            schedule = len(self._pending_updates) == 0
+            self._pending_updates.update(status)
+        if schedule:
+            try:
+                self._update_loop.call_soon_threadsafe(self._flush_updates)
+            except RuntimeError:
+                # The loop is closed while shutting down
+                pass
+
+    def _flush_updates(self):
+        with self._updates_lock:
+            status = self._pending_updates
+            self._pending_updates = {}
+        if len(status) > 0:
+            self._deliver_updates(status)
+
+    def _deliver_updates(self, status):
+        index = self._update_index
+        if "connected" in status:
+            subscribed = [update for updates in index.values() for update in updates]
+        else:
+            subscribed = [update for attr in status for update in index.get(attr, ())]
+        # An update subscribed to several of the changed attributes is called once
+        for update in dict.fromkeys(self._updates + subscribed):
             update(status)
 
+    def _data_received(self, connection, data):
+        if connection is not self._connection:
+            # Left over from a connection already closed or replaced
+            return
+        if self._handshake is not None:
+            if not self._handshake.done():
+                self._handshake.set_result(data)
+            return
+        if (capture := self._capture) is not None:
+            capture.record(DIRECTION_RECEIVED, KIND_WIRE, data)
+        self._metrics.data_received(len(data))
+        try:
+            result = self._parse_message(data)
+            if result == ParseMessageResult.ERROR:
+                MideaLogger.debug(f"Message 'ERROR' received")
+                self._close_transport()
+            elif result == ParseMessageResult.SUCCESS:
+                self._last_received = time.monotonic()
+        except Exception as e:
+            MideaLogger.error(f"Unknown error :{e.__traceback__.tb_frame.f_globals['__file__']}, "
+                              f"{e.__traceback__.tb_lineno}, {repr(e)}")
+            self._close_transport()
+
+    def _connection_made(self, connection):
+        self._connection = connection
+
+    def _connection_lost(self, connection, exc):
+        if connection is not self._connection:
+            # A late notice of a connection already closed or replaced, the current one is fine
+            return
+        if exc is not None:
+            MideaLogger.debug(f"Socket error {repr(exc)}")
+        self._close_transport()
+
+    def _schedule_refresh(self):
+        if self._refresh_timer is not None:
+            self._refresh_timer.cancel()
+            self._refresh_timer = None
+        if self._transport is not None and self._run_task is not None:
+            if (delay := self._scheduler.next_delay()) is not None:
+                self._refresh_timer = asyncio.get_running_loop().call_later(delay, self._refresh_tick)
+
+    def _refresh_tick(self):
+        self._refresh_timer = None
+        if self._scheduler.should_poll():
+            self._refresh_status()
+        self._schedule_refresh()
+
+    def _heartbeat_tick(self):
+        self._heartbeat_timer = None
+        if time.monotonic() - self._last_received >= self._heartbeat_timeout:
+            MideaLogger.debug(f"Heartbeat timed out")
+            self._metrics.heartbeat_timeout()
+            self._close_transport()
+            return
+        self._send_heartbeat()
+        self._heartbeat_timer = asyncio.get_running_loop().call_later(
+            self._heartbeat_interval, self._heartbeat_tick
+        )
+
+    def _cancel_timers(self):
+        for timer in (self._refresh_timer, self._heartbeat_timer):
+            if timer is not None:
+                timer.cancel()
+        self._refresh_timer = None
+        self._heartbeat_timer = None
+
+    def _cancel_control(self):
+        if self._control_timer is not None:
+            self._control_timer.cancel()
+            self._control_timer = None
+        with self._pending_lock:
+            self._pending_control = {}
+
+    async def _run(self):
+        loop = asyncio.get_running_loop()
+        while self._is_run:
+            async with self._engine.connections.admit(self._priority):
+                connected = await self._async_connect(refresh=True)
+            if not connected:
+                if not self._is_run:
+                    return
+                delay = self._reconnect.next_delay()
+                MideaLogger.debug(
+                    f"Reconnect in {delay:.1f}s, attempt {self._reconnect.attempts}", device_id=self._device_id
+                )
+                await self._wait_reconnect(delay)
+                continue
+            self._reconnect.reset()
+            self._last_received = time.monotonic()
+            self._schedule_refresh()
+            self._heartbeat_timer = loop.call_later(self._heartbeat_interval, self._heartbeat_tick)
+            try:
+                await self._lost.wait()
+            finally:
+                self._cancel_timers()
+
+    def _start(self):
+        self._run_task = asyncio.get_running_loop().create_task(self._run())
+
+    def _stop(self):
+        self._cancel_timers()
+        self._cancel_control()
+        self._cancel_waiters()
+        if self._run_task is not None:
+            self._run_task.cancel()
+            self._run_task = None
+        self._close_transport()
+        # Released in the engine loop, which may be decoding or querying meanwhile
+        if self._lua_runtime is not None:
+            self._lua_runtime.release()
+            self._lua_runtime = None
+
     def open(self):
         if not self._is_run:
             self._is_run = True
-            threading.Thread.start(self)
+            self._engine.call_soon(self._start)
 
     def close(self):
         if self._is_run:
             self._is_run = False
-            self._lua_runtime = None
-            self.disconnect()
-
-    def run(self):
-        while self._is_run:
-            while self._socket is None:
-                if self.connect(refresh=True) is False:
-                    if not self._is_run:
-                        return
-                    self.disconnect()
-                    time.sleep(5)
-            timeout_counter = 0
-            start = time.time()
-            previous_refresh = start
-            previous_heartbeat = start
-            self._socket.settimeout(1)
-            while True:
-                try:
-                    now = time.time()
-                    if 0 < self._refresh_interval <= now - previous_refresh:
-                        self._refresh_status()
-                        previous_refresh = now
-                    if now - previous_heartbeat >= self._heartbeat_interval:
-                        self._send_heartbeat()
-                        previous_heartbeat = now
-                    msg = self._socket.recv(512)
-                    msg_len = len(msg)
-                    if msg_len == 0:
-                        raise socket.error("Connection closed by peer")
-                    result = self._parse_message(msg)
-                    if result == ParseMessageResult.ERROR:
-                        MideaLogger.debug(f"Message 'ERROR' received")
-                        self.disconnect()
-                        break
-                    elif result == ParseMessageResult.SUCCESS:
-                        timeout_counter = 0
-                except socket.timeout:
-                    timeout_counter = timeout_counter + 1
-                    if timeout_counter >= 120:
-                        MideaLogger.debug(f"Heartbeat timed out")
-                        self.disconnect()
-                        break
-                except socket.error as e:
-                    MideaLogger.debug(f"Socket error {repr(e)}")
-                    self.disconnect()
-                    break
-                except Exception as e:
-                    MideaLogger.error(f"Unknown error :{e.__traceback__.tb_frame.f_globals['__file__']}, "
-                                      f"{e.__traceback__.tb_lineno}, {repr(e)}")
-                    self.disconnect()
-                    break
-
-
+            # Called in the event loop, the writer thread closes the file on its own
+            self.stop_capture(wait=False)
+            self._engine.call_soon(self._stop)
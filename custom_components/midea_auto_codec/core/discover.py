@@ -1,4 +1,5 @@
-import socket
+import asyncio
+import time
 import ifaddr
 from ipaddress import IPv4Network
 from .security import LocalSecurity
@@ -32,88 +33,203 @@ DEVICE_INFO_MSG = bytearray([
 ])
 
 
-def discover(discover_type=None, ip_address=None):
-    MideaLogger.debug(f"Begin discover, type: {discover_type}, ip_address: {ip_address}")
+def parse_reply(data, ip, security: LocalSecurity):
+    """
+    Parse one reply to the discovery broadcast, return the device or None.
+    For protocol 1 devices the device_id is left None, it has to be taken
+    from get_device_info.
+    """
+    if len(data) >= 104 and (data[:2].hex() == "5a5a" or data[8:10].hex() == "5a5a"):
+        if data[:2].hex() == "5a5a":
+            protocol = 2
+        elif data[:2].hex() == "8370":
+            protocol = 3
+            if data[8:10].hex() == "5a5a":
+                data = data[8:-16]
+        else:
+            return None
+        device_id = int.from_bytes(bytearray.fromhex(data[20:26].hex()), "little")
+        encrypt_data = data[40:-16]
+        reply = security.aes_decrypt(encrypt_data)
+        MideaLogger.debug(f"Declassified reply: {reply.hex()}")
+        ssid = reply[41:41 + reply[40]].decode("utf-8")
+        device_type = ssid.split("_")[1]
+        port = bytes2port(reply[4:8])
+        model = reply[17:25].decode("utf-8")
+        sn = reply[8:40].decode("utf-8")
+    elif data[:6].hex() == "3c3f786d6c20":
+        protocol = 1
+        root = ET.fromstring(data.decode(
+            encoding="utf-8", errors="replace"))
+        child = root.find("body/device")
+        m = child.attrib
+        port, sn, device_type = int(m["port"]), m["apc_sn"], str(
+            hex(int(m["apc_type"])))[2:]
+        device_id = None
+        if len(sn) == 32:
+            model = sn[9:17]
+        elif len(sn) == 22:
+            model = sn[3:11]
+        else:
+            model = ""
+    else:
+        return None
+    return {
+        "device_id": device_id,
+        "type": int(device_type, 16),
+        "ip_address": ip,
+        "port": port,
+        "model": model,
+        "sn": sn,
+        "protocol": protocol
+    }
+
+
+def _is_wanted(device, discover_type):
+    if len(discover_type) == 0 or device.get("type") in discover_type:
+        MideaLogger.debug(f"Found a supported device: {device}")
+        return True
+    MideaLogger.debug(f"Found a unsupported device: {device}")
+    return False
+
+
+class _DiscoverProtocol(asyncio.DatagramProtocol):
+    def __init__(self, queue: asyncio.Queue):
+        self._queue = queue
+
+    def datagram_received(self, data, addr):
+        MideaLogger.debug(f"Received broadcast from {addr}: {data.hex()}")
+        self._queue.put_nowait((data, addr[0]))
+
+    def error_received(self, exc):
+        MideaLogger.debug(f"Socket error: {repr(exc)}")
+
+
+async def async_discover(discover_type=None, ip_address=None, timeout=5, info_timeout=8):
+    """
+    Broadcast to all the subnets at once and yield the devices as their
+    replies arrive. The device IDs of protocol 1 devices are looked up in
+    parallel, the whole discovery takes at most timeout + info_timeout seconds.
+    """
+    MideaLogger.debug(f"Begin async discover, type: {discover_type}, ip_address: {ip_address}")
     if discover_type is None:
         discover_type = []
+    loop = asyncio.get_running_loop()
     security = LocalSecurity()
-    sock = socket.socket(socket.AF_INET, socket.SOCK_DGRAM)
-    sock.setsockopt(socket.SOL_SOCKET, socket.SO_BROADCAST, 1)
-    sock.settimeout(5)
-    found_devices = {}
+    queue = asyncio.Queue()
+    transport, _ = await loop.create_datagram_endpoint(
+        lambda: _DiscoverProtocol(queue), local_addr=("0.0.0.0", 0), allow_broadcast=True
+    )
     if ip_address is None:
-        addrs = enum_all_broadcast()
+        addrs = await loop.run_in_executor(None, enum_all_broadcast)
     else:
         addrs = [ip_address]
 
-    for v in range(0, 3):
-        for addr in addrs:
-            sock.sendto(BROADCAST_MSG, (addr, 6445))
-            sock.sendto(BROADCAST_MSG, (addr, 20086))
-    while True:
+    async def broadcast():
+        for _ in range(0, 3):
+            for addr in addrs:
+                try:
+                    transport.sendto(BROADCAST_MSG, (addr, 6445))
+                    transport.sendto(BROADCAST_MSG, (addr, 20086))
+                except OSError as e:
+                    MideaLogger.debug(f"Send to {addr} failed: {repr(e)}")
+            await asyncio.sleep(0.5)
+
+    async def lookup(device):
+        device["device_id"] = 0
         try:
-            data, addr = sock.recvfrom(512)
-            ip = addr[0]
-            MideaLogger.debug(f"Received broadcast from {addr}: {data.hex()}")
-            if len(data) >= 104 and (data[:2].hex() == "5a5a" or data[8:10].hex() == "5a5a"):
-                if data[:2].hex() == "5a5a":
-                    protocol = 2
-                elif data[:2].hex() == "8370":
-                    protocol = 3
-                    if data[8:10].hex() == "5a5a":
-                        data = data[8:-16]
-                else:
+            response = await async_get_device_info(device["ip_address"], device["port"], info_timeout)
+            device["device_id"] = get_id_from_response(response)
+        except (ET.ParseError, AttributeError, KeyError, ValueError) as e:
+            MideaLogger.debug(f"Invalid device info from {device['ip_address']}: {repr(e)}")
+        finally:
+            queue.put_nowait(device)
+
+    sender = loop.create_task(broadcast())
+    lookups = []
+    looked_up = set()
+    found = set()
+    deadline = loop.time() + timeout
+    try:
+        while True:
+            remaining = deadline - loop.time()
+            if remaining <= 0:
+                # Only the protocol 1 lookups are left, they have their own timeout
+                lookups = [task for task in lookups if not task.done()]
+                if len(lookups) == 0 and queue.empty():
+                    break
+                remaining = None
+            try:
+                item = await asyncio.wait_for(queue.get(), timeout=remaining)
+            except asyncio.TimeoutError:
+                continue
+            if isinstance(item, dict):
+                device = item
+            else:
+                data, ip = item
+                if remaining is None:
                     continue
-                device_id = int.from_bytes(bytearray.fromhex(data[20:26].hex()), "little")
-                if device_id in found_devices:
+                try:
+                    device = parse_reply(data, ip, security)
+                except (ET.ParseError, AttributeError, IndexError, KeyError, ValueError) as e:
+                    MideaLogger.debug(f"Invalid reply from {ip}: {repr(e)}")
                     continue
-                encrypt_data = data[40:-16]
-                reply = security.aes_decrypt(encrypt_data)
-                MideaLogger.debug(f"Declassified reply: {reply.hex()}")
-                ssid = reply[41:41 + reply[40]].decode("utf-8")
-                device_type = ssid.split("_")[1]
-                port = bytes2port(reply[4:8])
-                model = reply[17:25].decode("utf-8")
-                sn = reply[8:40].decode("utf-8")
-            elif data[:6].hex() == "3c3f786d6c20":
-                protocol = 1
-                root = ET.fromstring(data.decode(
-                    encoding="utf-8", errors="replace"))
-                child = root.find("body/device")
-                m = child.attrib
-                port, sn, device_type = int(m["port"]), m["apc_sn"], str(
-                    hex(int(m["apc_type"])))[2:]
-                response = get_device_info(ip, int(port))
-                device_id = get_id_from_response(response)
-                if len(sn) == 32:
-                    model = sn[9:17]
-                elif len(sn) == 22:
-                    model = sn[3:11]
-                else:
-                    model = ""
-            else:
+                if device is None:
+                    continue
+                if device["device_id"] is None:
+                    if ip not in looked_up:
+                        looked_up.add(ip)
+                        lookups.append(loop.create_task(lookup(device)))
+                    continue
+            if device["device_id"] in found:
                 continue
-            device = {
-                "device_id": device_id,
-                "type": int(device_type, 16),
-                "ip_address": ip,
-                "port": port,
-                "model": model,
-                "sn": sn,
-                "protocol": protocol
-            }
-            if len(discover_type) == 0 or device.get("type") in discover_type:
-                found_devices[device_id] = device
-                MideaLogger.debug(f"Found a supported device: {device}")
-            else:
-                MideaLogger.debug(f"Found a unsupported device: {device}")
-            if ip_address is not None:
-                break
-        except socket.timeout:
-            break
-        except socket.error as e:
-            MideaLogger.debug(f"Socket error: {repr(e)}")
-    return found_devices
+            found.add(device["device_id"])
+            if _is_wanted(device, discover_type):
+                yield device
+                if ip_address is not None:
+                    break
+    finally:
+        sender.cancel()
+        for task in lookups:
+            task.cancel()
+        transport.close()
+
+
+class DiscoveryCache:
+    """
+    The last seen address of every device, device_id -> discovered device,
+    an entry is forgotten ttl seconds after the device answered last time.
+    """
+    def __init__(self, ttl=900):
+        self._ttl = ttl
+        self._devices = {}
+        self._last_scan = 0
+
+    @property
+    def last_scan(self):
+        return self._last_scan
+
+    def update(self, device):
+        self._devices[device["device_id"]] = (device, time.monotonic())
+
+    def get(self, device_id):
+        if item := self._devices.get(device_id):
+            device, seen = item
+            if time.monotonic() - seen < self._ttl:
+                return device
+            self._devices.pop(device_id, None)
+        return None
+
+    async def async_scan(self, discover_type=None, ip_address=None):
+        self._last_scan = time.monotonic()
+        devices = []
+        async for device in async_discover(discover_type, ip_address):
+            self.update(device)
+            devices.append(device)
+        return devices
+
+
+discovery_cache = DiscoveryCache()
 
 
 def get_id_from_response(response):
@@ -141,22 +257,25 @@ def bytes2port(paramArrayOfbyte):
     return i
 
 
-def get_device_info(device_ip, device_port: int):
+async def async_get_device_info(device_ip, device_port: int, timeout=8):
     response = bytearray(0)
+    writer = None
     try:
-        with socket.socket(socket.AF_INET, socket.SOCK_STREAM) as sock:
-            sock.settimeout(8)
-            device_address = (device_ip, device_port)
-            sock.connect(device_address)
+        # One timeout for the connect and the reply together
+        async with asyncio.timeout(timeout):
+            reader, writer = await asyncio.open_connection(device_ip, device_port)
             MideaLogger.debug(f"Sending to {device_ip}:{device_port} {DEVICE_INFO_MSG.hex()}")
-            sock.sendall(DEVICE_INFO_MSG)
-            response = sock.recv(512)
-    except socket.timeout:
-        MideaLogger.warning(f"Connect the device {device_ip}:{device_port} timed out for 8s. "
-                        f"Don't care about a small amount of this. if many maybe not support."
-                        )
-    except socket.error:
+            writer.write(DEVICE_INFO_MSG)
+            response = await reader.read(512)
+    except asyncio.TimeoutError:
+        MideaLogger.warning(f"Connect the device {device_ip}:{device_port} timed out for {timeout}s. "
+                            f"Don't care about a small amount of this. if many maybe not support."
+                            )
+    except OSError:
         MideaLogger.warning(f"Can't connect to Device {device_ip}:{device_port}")
+    finally:
+        if writer is not None:
+            writer.close()
     return response
 
 
@@ -0,0 +1,122 @@
+import asyncio
+import contextlib
+import heapq
+import itertools
+import threading
+
+
+class ConnectionManager:
+    """
+    Admits a bounded number of devices into connecting at the same time,
+    the waiting devices are admitted by priority (lower first), then in
+    the order they arrived. Runs in the engine loop only.
+    """
+    def __init__(self, limit=4):
+        self._limit = limit
+        self._active = 0
+        self._waiters = []
+        self._sequence = itertools.count()
+
+    @property
+    def limit(self):
+        return self._limit
+
+    @limit.setter
+    def limit(self, limit):
+        self._limit = limit
+        self._wake_waiters()
+
+    @property
+    def active(self):
+        return self._active
+
+    @property
+    def waiting(self):
+        return sum(1 for waiter in self._waiters if not waiter[2].done())
+
+    async def acquire(self, priority=0):
+        if self._active < self._limit and self.waiting == 0:
+            self._active += 1
+            return
+        future = asyncio.get_running_loop().create_future()
+        heapq.heappush(self._waiters, (priority, next(self._sequence), future))
+        try:
+            await future
+        except asyncio.CancelledError:
+            if future.done() and not future.cancelled():
+                # Admitted just before being cancelled, give the slot to the next one
+                self.release()
+            raise
+
+    def release(self):
+        self._active -= 1
+        self._wake_waiters()
+
+    def _wake_waiters(self):
+        while self._waiters and self._active < self._limit:
+            _, _, future = heapq.heappop(self._waiters)
+            if not future.done():
+                self._active += 1
+                future.set_result(None)
+
+    @contextlib.asynccontextmanager
+    async def admit(self, priority=0):
+        await self.acquire(priority)
+        try:
+            yield
+        finally:
+            self.release()
+
+
+class MideaEngine:
+    """
+    One shared asyncio event loop, running in a single background thread,
+    which drives the connections of all the devices.
+    """
+    _instance = None
+    _instance_lock = threading.Lock()
+
+    def __init__(self):
+        self._loop = None
+        self._thread = None
+        self._lock = threading.Lock()
+        self._connections = ConnectionManager()
+
+    @classmethod
+    def instance(cls):
+        with cls._instance_lock:
+            if cls._instance is None:
+                cls._instance = cls()
+            return cls._instance
+
+    @property
+    def loop(self) -> asyncio.AbstractEventLoop:
+        with self._lock:
+            if self._loop is None or self._loop.is_closed():
+                self._loop = asyncio.new_event_loop()
+                self._thread = threading.Thread(target=self._run, name="midea_auto_codec", daemon=True)
+                self._thread.start()
+            return self._loop
+
+    @property
+    def connections(self) -> ConnectionManager:
+        return self._connections
+
+    def _run(self):
+        asyncio.set_event_loop(self._loop)
+        self._loop.run_forever()
+
+    def in_loop(self):
+        return self._thread is not None and threading.get_ident() == self._thread.ident
+
+    def call_soon(self, callback, *args):
+        if self.in_loop():
+            callback(*args)
+        else:
+            self.loop.call_soon_threadsafe(callback, *args)
+
+    def run_coroutine(self, coro):
+        return asyncio.run_coroutine_threadsafe(coro, self.loop)
+
+    async def async_run_coroutine(self, coro):
+        return await asyncio.wrap_future(self.run_coroutine(coro))
@@ -1,36 +1,62 @@
-import inspect
+import sys
 import logging
 from enum import IntEnum
 
 
 class MideaLogType(IntEnum):
-    DEBUG = 1
-    WARN = 2
-    ERROR = 3
+    DEBUG = logging.DEBUG
+    WARN = logging.WARNING
+    ERROR = logging.ERROR
+
+
+class LazyHex:
+    """
+    Formats the bytes as hex only when the log record is emitted.
+    """
+    __slots__ = ("_data",)
+
+    def __init__(self, data):
+        self._data = data
+
+    def __str__(self):
+        return bytes(self._data).hex()
 
 
 class MideaLogger:
+    """
+    Logs to the logger of the calling module. The message may be a format
+    string with args, like the logging module it's only formatted when the
+    level is enabled, so a per-frame debug log costs next to nothing otherwise:
+
+        MideaLogger.debug("Received: %s", LazyHex(data), device_id=self._device_id)
+    """
+    _loggers = {}
+
+    @staticmethod
+    def _logger(name):
+        logger = MideaLogger._loggers.get(name)
+        if logger is None:
+            logger = MideaLogger._loggers[name] = logging.getLogger(name)
+        return logger
+
     @staticmethod
-    def _log(log_type, log, device_id):
-        frm = inspect.stack()[2]
-        mod = inspect.getmodule(frm[0])
+    def _log(log_type, log, device_id, args):
+        # 0 is _log, 1 is debug/warning/error, 2 is the caller
+        logger = MideaLogger._logger(sys._getframe(2).f_globals.get("__name__", __name__))
+        if not logger.isEnabledFor(log_type):
+            return
         if device_id is not None:
             log = f"[{device_id}] {log}"
-        if log_type == MideaLogType.DEBUG:
-            logging.getLogger(mod.__name__).debug(log)
-        elif log_type == MideaLogType.WARN:
-            logging.getLogger(mod.__name__).warning(log)
-        elif log_type == MideaLogType.ERROR:
-            logging.getLogger(mod.__name__).error(log)
+        logger.log(log_type, log, *args, stacklevel=3)
 
     @staticmethod
-    def debug(log, device_id=None):
-        MideaLogger._log(MideaLogType.DEBUG, log, device_id)
+    def debug(log, *args, device_id=None):
+        MideaLogger._log(MideaLogType.DEBUG, log, device_id, args)
 
     @staticmethod
-    def warning(log, device_id=None):
-        MideaLogger._log(MideaLogType.WARN, log, device_id)
+    def warning(log, *args, device_id=None):
+        MideaLogger._log(MideaLogType.WARN, log, device_id, args)
 
     @staticmethod
-    def error(log, device_id=None):
-        MideaLogger._log(MideaLogType.ERROR, log, device_id)
\ No newline at end of file
+    def error(log, *args, device_id=None):
+        MideaLogger._log(MideaLogType.ERROR, log, device_id, args)
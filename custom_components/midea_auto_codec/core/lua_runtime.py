@@ -3,34 +3,353 @@ import threading
 import json
 from .logger import MideaLogger
 
+# Wraps cjson.lua so that the scripts can be called with Lua tables instead of
+# JSON strings: decode() returns a table as it is, and while passthrough is set
+# encode() hands the table back to Python instead of serializing it.
+NATIVE_JSON_LUA = """
+local path = package.searchpath("cjson", package.path)
+if path == nil then return end
+local pure = dofile(path)
+local M = setmetatable({passthrough = false}, {__index = pure})
+
+function M.decode(value)
+  if type(value) == "table" then return value end
+  return pure.decode(value)
+end
+
+function M.encode(value)
+  if M.passthrough and type(value) == "table" then return value end
+  return pure.encode(value)
+end
+
+package.loaded["cjson"] = M
+return M
+"""
+
+# The bit module of the scripts on the integer operators of Lua 5.3+. For
+# the usual operands, integers in [0, 2^32), the results are those of the
+# pure Lua bit.numberlua (bit.lua), down to the number type: band, bor, bnot,
+# bxor and lshift return floats, rshift an integer. Any other operand is left
+# to the function of bit.lua itself. Not loaded on older Lua or LuaJIT, where
+# the scripts require bit.lua as before.
+NATIVE_BIT_LUA = """
+if math.tointeger == nil then return end
+local path = package.searchpath("bit", package.path)
+if path == nil then return end
+local pure = dofile(path)
+local M = setmetatable({}, {__index = pure})
+local tointeger = math.tointeger
+local MASK = 0xFFFFFFFF
+
+local function u32(x)
+  x = tointeger(x)
+  if x ~= nil and x >= 0 and x <= MASK then return x end
+  return nil
+end
+
+local function shift(disp)
+  disp = tointeger(disp)
+  if disp ~= nil and disp >= 0 and disp < 32 then return disp end
+  return nil
+end
+
+function M.band(a, b)
+  local x, y = u32(a), u32(b)
+  if x == nil or y == nil then return pure.band(a, b) end
+  return (x & y) + 0.0
+end
+
+function M.bor(a, b)
+  local x, y = u32(a), u32(b)
+  if x == nil or y == nil then return pure.bor(a, b) end
+  return (x | y) + 0.0
+end
+
+function M.bxor(a, b)
+  -- bit.lua returns a + b as it is when either is 0
+  if a == 0 or b == 0 then return pure.bxor(a, b) end
+  local x, y = u32(a), u32(b)
+  if x == nil or y == nil then return pure.bxor(a, b) end
+  return (x ~ y) + 0.0
+end
+
+function M.bnot(a)
+  local x = u32(a)
+  if x == nil then return pure.bnot(a) end
+  return (MASK - x) + 0.0
+end
+
+function M.rshift(a, disp)
+  local x, d = u32(a), shift(disp)
+  if x == nil or d == nil then return pure.rshift(a, disp) end
+  return x >> d
+end
+
+function M.lshift(a, disp)
+  local x, d = u32(a), shift(disp)
+  if x == nil or d == nil then return pure.lshift(a, disp) end
+  return ((x << d) & MASK) + 0.0
+end
+
+local band, bnot, rshift, lshift = M.band, M.bnot, M.rshift, M.lshift
+
+-- The functions of bit.lua built on the ones above, on the native ones here
+
+function M.tohex(x, n)
+  n = n or 8
+  local up
+  if n <= 0 then
+    if n == 0 then return '' end
+    up = true
+    n = - n
+  end
+  x = band(x, 16^n-1)
+  return ('%0'..n..(up and 'X' or 'x')):format(x)
+end
+
+function M.extract(n, field, width)
+  width = width or 1
+  return band(rshift(n, field), 2^width-1)
+end
+
+function M.replace(n, v, field, width)
+  width = width or 1
+  local mask1 = 2^width-1
+  v = band(v, mask1)
+  local mask = bnot(lshift(mask1, field))
+  return band(n, mask) + lshift(v, field)
+end
+
+function M.bswap(x)
+  local a = band(x, 0xff); x = rshift(x, 8)
+  local b = band(x, 0xff); x = rshift(x, 8)
+  local c = band(x, 0xff); x = rshift(x, 8)
+  local d = band(x, 0xff)
+  return lshift(lshift(lshift(a, 8) + b, 8) + c, 8) + d
+end
+
+function M.rrotate(x, disp)
+  disp = disp % 32
+  local low = band(x, 2^disp-1)
+  return rshift(x, disp) + lshift(low, 32-disp)
+end
+
+function M.lrotate(x, disp)
+  return M.rrotate(x, -disp)
+end
+
+M.rol = M.lrotate
+M.ror = M.rrotate
+
+function M.arshift(x, disp)
+  local z = rshift(x, disp)
+  if x >= 0x80000000 then z = z + lshift(2^disp-1, 32-disp) end
+  return z
+end
+
+function M.btest(x, y)
+  return band(x, y) ~= 0
+end
+
+package.loaded["bit"] = M
+return M
+"""
+
+
+def _lua_to_python(value):
+    if lupa.lua_type(value) == "table":
+        # Follow cjson.lua, which encodes a table as an array if it is empty or has the key 1
+        keys = list(value.keys())
+        if len(keys) == 0 or 1 in keys:
+            return [_lua_to_python(value[index]) for index in range(1, len(keys) + 1)]
+        return {str(key): _lua_to_python(item) for key, item in value.items()}
+    if isinstance(value, float):
+        # cjson.lua writes numbers in '%.14g'
+        value = float("%.14g" % value)
+        if value.is_integer():
+            return int(value)
+    return value
+
+
+# Compiles the script once, then runs it in a new global table for every
+# device, so the status tables the scripts keep in globals aren't shared.
+# Reading a global falls back to _G, the libraries are still shared.
+SCOPE_LOADER_LUA = """
+function(file)
+  local chunk = assert(loadfile(file))
+  local bytecode = string.dump(chunk)
+  return function()
+    local env = setmetatable({}, {__index = _G})
+    local main
+    if setfenv ~= nil then
+      main = assert(loadstring(bytecode, "=" .. file))
+      setfenv(main, env)
+    else
+      main = assert(load(bytecode, "=" .. file, "b", env))
+    end
+    main()
+    return env.jsonToData, env.dataToJson
+  end
+end
+"""
+
 
 class LuaRuntime:
-    def __init__(self, file):
+    """
+    One Lua state per script, shared by the devices. Each device gets its
+    own LuaScope with the globals of the script.
+    """
+    def __init__(self, file, native_json=True, native_bit=True):
         self._runtimes = lupa.LuaRuntime()
-        string = f'dofile("{file}")'
-        self._runtimes.execute(string)
+        self._cjson = self._runtimes.execute(NATIVE_JSON_LUA) if native_json else None
+        self._native_bit = native_bit and self._runtimes.execute(NATIVE_BIT_LUA) is not None
         self._lock = threading.Lock()
-        self._json_to_data = self._runtimes.eval("function(param) return jsonToData(param) end")
-        self._data_to_json = self._runtimes.eval("function(param) return dataToJson(param) end")
+        memory_kb = self._runtimes.eval("collectgarbage('count')")
+        self._load_scope = self._runtimes.eval(SCOPE_LOADER_LUA)(file)
+        self._memory_kb = self._runtimes.eval("collectgarbage('count')")
+        # What a device costs on top of the shared state, approximately
+        self._scope_kb = self._memory_kb - memory_kb
 
-    def json_to_data(self, json_value):
+    @property
+    def memory_kb(self):
+        return self._memory_kb
+
+    @property
+    def scope_kb(self):
+        return self._scope_kb
+
+    @property
+    def native_json(self):
+        return self._cjson is not None
+
+    @property
+    def native_bit(self):
+        return self._native_bit
+
+    def create_scope(self):
         with self._lock:
-            result = self._json_to_data(json_value)
+            json_to_data, data_to_json = self._load_scope()
+        return LuaScope(self, json_to_data, data_to_json)
+
+    def _disable_native_json(self, error):
+        MideaLogger.warning(f"The lua script doesn't work with native JSON, fallback to JSON strings: {repr(error)}")
+        self._cjson = None
+
+
+class LuaScope:
+    def __init__(self, runtime: LuaRuntime, json_to_data, data_to_json):
+        self._runtime = runtime
+        self._json_to_data = json_to_data
+        self._data_to_json = data_to_json
 
+    def json_to_data(self, json_value):
+        with self._runtime._lock:
+            result = self._json_to_data(json_value)
         return result
 
     def data_to_json(self, data_value):
-        with self._lock:
+        with self._runtime._lock:
             result = self._data_to_json(data_value)
         return result
 
+    def json_to_data_native(self, data: dict):
+        runtime = self._runtime
+        with runtime._lock:
+            if runtime._cjson is not None:
+                try:
+                    return self._json_to_data(runtime._runtimes.table_from(data, recursive=True))
+                except lupa.LuaError as e:
+                    result = self._json_to_data(json.dumps(data))
+                    runtime._disable_native_json(e)
+                    return result
+            return self._json_to_data(json.dumps(data))
+
+    def data_to_json_native(self, data: dict):
+        runtime = self._runtime
+        with runtime._lock:
+            if (cjson := runtime._cjson) is not None:
+                cjson.passthrough = True
+                try:
+                    result = self._data_to_json(runtime._runtimes.table_from(data, recursive=True))
+                except lupa.LuaError as e:
+                    cjson.passthrough = False
+                    result = self._data_to_json(json.dumps(data))
+                    runtime._disable_native_json(e)
+                finally:
+                    cjson.passthrough = False
+                if lupa.lua_type(result) == "table":
+                    return _lua_to_python(result)
+                return json.loads(result)
+            return json.loads(self._data_to_json(json.dumps(data)))
 
-class MideaCodec(LuaRuntime):
-    def __init__(self, file, sn=None, subtype=None):
-        super().__init__(file)
+
+class LuaRuntimePool:
+    def __init__(self, native_json=True, native_bit=True):
+        self._lock = threading.Lock()
+        self._runtimes = {}
+        self._native_json = native_json
+        self._native_bit = native_bit
+
+    def acquire(self, file) -> LuaRuntime:
+        with self._lock:
+            if file in self._runtimes:
+                item = self._runtimes[file]
+                item["references"] += 1
+                MideaLogger.debug(f"Shared lua runtime {file} with {item['references']} devices, "
+                                  f"{self.stats()['saved_kb']:.1f} KB saved in total")
+            else:
+                item = {"runtime": LuaRuntime(
+                    file, native_json=self._native_json, native_bit=self._native_bit
+                ), "references": 1}
+                self._runtimes[file] = item
+            return item["runtime"]
+
+    def release(self, file):
+        with self._lock:
+            if item := self._runtimes.get(file):
+                item["references"] -= 1
+                if item["references"] <= 0:
+                    self._runtimes.pop(file)
+
+    def stats(self):
+        runtimes = list(self._runtimes.values())
+        return {
+            "runtimes": len(runtimes),
+            "references": sum(item["references"] for item in runtimes),
+            "memory_kb": sum(item["runtime"].memory_kb for item in runtimes),
+            "saved_kb": sum((item["runtime"].memory_kb - item["runtime"].scope_kb) * (item["references"] - 1)
+                            for item in runtimes)
+        }
+
+
+codec_pool = LuaRuntimePool()
+
+
+class MideaCodec:
+    def __init__(self, file, sn=None, subtype=None, pool: LuaRuntimePool | None = None):
+        self._file = file
+        self._pool = pool if pool is not None else codec_pool
+        self._runtime = self._pool.acquire(file)
+        self._scope = self._runtime.create_scope()
         self._sn = sn
         self._subtype = subtype
 
+    def release(self):
+        if self._runtime is not None:
+            self._runtime = None
+            self._scope = None
+            self._pool.release(self._file)
+
+    def json_to_data(self, json_value):
+        if (scope := self._scope) is None:
+            return None
+        return scope.json_to_data(json_value)
+
+    def data_to_json(self, data_value):
+        if (scope := self._scope) is None:
+            return None
+        return scope.data_to_json(data_value)
+
     def _build_base_dict(self):
         device_info ={}
         if self._sn is not None:
@@ -43,49 +362,51 @@ class MideaCodec(LuaRuntime):
         return base_dict
 
     def build_query(self, append=None):
+        if (scope := self._scope) is None:
+            return None
         query_dict = self._build_base_dict()
         query_dict["query"] = {} if append is None else append
-        json_str = json.dumps(query_dict)
         try:
-            result = self.json_to_data(json_str)
+            result = scope.json_to_data_native(query_dict)
             return result
         except lupa.LuaError as e:
-            MideaLogger.error(f"LuaRuntimeError in build_query {json_str}: {repr(e)}")
+            MideaLogger.error(f"LuaRuntimeError in build_query {query_dict}: {repr(e)}")
         return None
 
     def build_control(self, append=None):
+        if (scope := self._scope) is None:
+            return None
         query_dict = self._build_base_dict()
         query_dict["control"] = {} if append is None else append
-        json_str = json.dumps(query_dict)
         try:
-            result = self.json_to_data(json_str)
+            result = scope.json_to_data_native(query_dict)
             return result
         except lupa.LuaError as e:
-            MideaLogger.error(f"LuaRuntimeError in build_control {json_str}: {repr(e)}")
+            MideaLogger.error(f"LuaRuntimeError in build_control {query_dict}: {repr(e)}")
             return None
 
     def build_status(self, append=None):
+        if (scope := self._scope) is None:
+            return None
         query_dict = self._build_base_dict()
         query_dict["status"] = {} if append is None else append
-        json_str = json.dumps(query_dict)
         try:
-            result = self.json_to_data(json_str)
+            result = scope.json_to_data_native(query_dict)
             return result
         except lupa.LuaError as e:
-            MideaLogger.error(f"LuaRuntimeError in build_status {json_str}: {repr(e)}")
+            MideaLogger.error(f"LuaRuntimeError in build_status {query_dict}: {repr(e)}")
             return None
 
     def decode_status(self, data: str):
+        if (scope := self._scope) is None:
+            return None
         data_dict = self._build_base_dict()
         data_dict["msg"] = {
             "data": data
         }
-        json_str = json.dumps(data_dict)
         try:
-            result = self.data_to_json(json_str)
-            status = json.loads(result)
+            status = scope.data_to_json_native(data_dict)
             return status.get("status")
         except lupa.LuaError as e:
             MideaLogger.error(f"LuaRuntimeError in decode_status {data}: {repr(e)}")
         return None
-
@@ -0,0 +1,126 @@
+import time
+
+
+class DeviceMetrics:
+    """
+    Runtime figures of one device, fed from the engine loop.
+    The times are kept as the last value, the maximum and an exponential
+    moving average, the frame rate is counted over a window of 60 seconds.
+    A request unanswered for RESPONSE_TIMEOUT seconds isn't timed any more.
+    Read with snapshot() from any thread.
+    """
+    RATE_WINDOW = 60
+    RESPONSE_TIMEOUT = 5
+    SMOOTHING = 0.2
+
+    def __init__(self):
+        self.started = time.time()
+        self.frames_received = 0
+        self.frames_sent = 0
+        self.bytes_received = 0
+        self.bytes_sent = 0
+        self.connects = 0
+        self.disconnects = 0
+        self.heartbeat_timeouts = 0
+        self.decode_errors = 0
+        self.last_connected = None
+        self._round_trip = [None, None, None]
+        self._decode = [None, None, None]
+        self._requests = {}
+        self._window_start = time.monotonic()
+        self._window_frames = 0
+        self._frame_rate = None
+
+    @classmethod
+    def _add(cls, stat, value):
+        last, average, maximum = stat
+        stat[0] = value
+        stat[1] = value if average is None else average + (value - average) * cls.SMOOTHING
+        stat[2] = value if maximum is None else max(maximum, value)
+
+    @property
+    def reconnects(self):
+        return max(self.connects - 1, 0)
+
+    @property
+    def frame_rate(self):
+        # The rate of the last full window, or of the current one until there is one
+        elapsed = time.monotonic() - self._window_start
+        if elapsed >= 2 * self.RATE_WINDOW or (elapsed >= self.RATE_WINDOW and self._window_frames == 0):
+            # No frame closed the windows since, the device went quiet
+            return self._window_frames / elapsed
+        if self._frame_rate is not None:
+            return self._frame_rate
+        return self._window_frames / elapsed if elapsed > 0 else 0
+
+    def connected(self):
+        self.connects += 1
+        self.last_connected = time.time()
+
+    def disconnected(self):
+        self.disconnects += 1
+        # A reply lost with the connection shouldn't count for the next one
+        self._requests = {}
+
+    def heartbeat_timeout(self):
+        self.heartbeat_timeouts += 1
+
+    def data_received(self, size):
+        self.bytes_received += size
+
+    def data_sent(self, size):
+        self.frames_sent += 1
+        self.bytes_sent += size
+
+    def frame_received(self):
+        self.frames_received += 1
+        self._window_frames += 1
+        now = time.monotonic()
+        if now - self._window_start >= self.RATE_WINDOW:
+            self._frame_rate = self._window_frames / (now - self._window_start)
+            self._window_start = now
+            self._window_frames = 0
+
+    def request(self, msg_type):
+        # Timed from the first request of a type still waiting for the reply,
+        # unless that one is too old to be answered any more
+        now = time.monotonic()
+        sent = self._requests.get(msg_type)
+        if sent is None or now - sent > self.RESPONSE_TIMEOUT:
+            self._requests[msg_type] = now
+
+    def response(self, msg_type):
+        if (sent := self._requests.pop(msg_type, None)) is not None:
+            elapsed = time.monotonic() - sent
+            if elapsed <= self.RESPONSE_TIMEOUT:
+                self._add(self._round_trip, elapsed)
+
+    def decoded(self, elapsed, success=True):
+        self._add(self._decode, elapsed)
+        if not success:
+            self.decode_errors += 1
+
+    @staticmethod
+    def _milliseconds(stat):
+        return {
+            name: round(value * 1000, 2) if value is not None else None
+            for name, value in zip(("last", "average", "max"), stat)
+        }
+
+    def snapshot(self):
+        return {
+            "frames_received": self.frames_received,
+            "frames_sent": self.frames_sent,
+            "frame_rate": round(self.frame_rate, 3),
+            "bytes_received": self.bytes_received,
+            "bytes_sent": self.bytes_sent,
+            "connects": self.connects,
+            "reconnects": self.reconnects,
+            "disconnects": self.disconnects,
+            "heartbeat_timeouts": self.heartbeat_timeouts,
+            "decode_errors": self.decode_errors,
+            "round_trip_time": self._milliseconds(self._round_trip),
+            "decode_time": self._milliseconds(self._decode),
+            "last_connected": self.last_connected,
+            "uptime": round(time.time() - self.started)
+        }
@@ -3,8 +3,8 @@ import datetime
 
 
 class PacketBuilder:
-    def __init__(self, device_id: int, command):
-        self.command = None
+    def __init__(self, device_id: int, command=None):
+        self.command = command
         self.security = LocalSecurity()
         # Init the packet with the header data.
         self.packet = bytearray([
@@ -25,20 +25,26 @@ class PacketBuilder:
             # 12 bytes
             0x00, 0x00, 0x00, 0x00, 0x00, 0x00, 0x00, 0x00, 0x00, 0x00, 0x00, 0x00
         ])
-        self.packet[12:20] = self.packet_time()
         self.packet[20:28] = device_id.to_bytes(8, "little")
-        self.command = command
+        # The header of the device, copied for every packet
+        self._template = bytes(self.packet)
 
-    def finalize(self, msg_type=1):
+    def build(self, command, msg_type=1):
+        packet = bytearray(self._template)
+        packet[12:20] = self.packet_time()
         if msg_type != 1:
-            self.packet[3] = 0x10
-            self.packet[6] = 0x7b
+            packet[3] = 0x10
+            packet[6] = 0x7b
         else:
-            self.packet.extend(self.security.aes_encrypt(self.command))
+            packet.extend(self.security.aes_encrypt(command))
         # PacketLenght
-        self.packet[4:6] = (len(self.packet) + 16).to_bytes(2, "little")
+        packet[4:6] = (len(packet) + 16).to_bytes(2, "little")
         # Append a basic checksum data(16 bytes) to the packet
-        self.packet.extend(self.encode32(self.packet))
+        packet.extend(self.encode32(packet))
+        return packet
+
+    def finalize(self, msg_type=1):
+        self.packet = self.build(self.command, msg_type)
         return self.packet
 
     def encode32(self, data: bytearray):
@@ -50,10 +56,8 @@ class PacketBuilder:
 
     @staticmethod
     def packet_time():
-        t = datetime.datetime.now().strftime("%Y%m%d%H%M%S%f")[
-            :16]
-        b = bytearray()
-        for i in range(0, len(t), 2):
-            d = int(t[i:i+2])
-            b.insert(0, d)
-        return b
+        now = datetime.datetime.now()
+        return bytearray([
+            now.microsecond // 10000, now.second, now.minute, now.hour,
+            now.day, now.month, now.year % 100, now.year // 100
+        ])
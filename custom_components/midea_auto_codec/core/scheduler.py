@@ -0,0 +1,103 @@
+import random
+import time
+
+
+class RefreshScheduler:
+    """
+    Decides when a device should be polled next.
+    A notify frame pushed by the device counts as a fresh state, a device
+    that pushed since the last poll is polled push_stretch times the interval
+    after that poll, so however often it pushes it's still polled. After a
+    control command one poll follows shortly to catch the new state. A random
+    jitter spreads the polls of the devices sharing the same interval.
+    """
+    def __init__(self, interval=30, push_stretch=2, control_delay=2, jitter=0.1):
+        self._interval = interval
+        self._push_stretch = push_stretch
+        self._control_delay = control_delay
+        self._jitter = jitter
+        self._last_poll = 0
+        self._last_notify = 0
+        self._last_control = None
+
+    @property
+    def interval(self):
+        return self._interval
+
+    @interval.setter
+    def interval(self, interval):
+        self._interval = interval
+
+    def polled(self, now=None):
+        self._last_poll = time.monotonic() if now is None else now
+        self._last_control = None
+
+    def notified(self, now=None):
+        self._last_notify = time.monotonic() if now is None else now
+
+    def controlled(self, now=None):
+        self._last_control = time.monotonic() if now is None else now
+
+    def due(self):
+        """
+        The monotonic time of the next poll, None if polling is disabled.
+        """
+        if self._interval <= 0:
+            return None
+        stretch = self._push_stretch if self._last_notify > self._last_poll else 1
+        due = self._last_poll + self._interval * stretch
+        if self._last_control is not None:
+            due = min(due, self._last_control + self._control_delay)
+        return due
+
+    def next_delay(self, now=None):
+        """
+        Seconds to wait before the scheduler should be asked again, with jitter,
+        None if polling is disabled.
+        """
+        due = self.due()
+        if due is None:
+            return None
+        now = time.monotonic() if now is None else now
+        return max(due - now, 0) + random.uniform(0, self._interval * self._jitter)
+
+    def should_poll(self, now=None):
+        due = self.due()
+        now = time.monotonic() if now is None else now
+        return due is not None and due <= now
+
+
+class ReconnectPolicy:
+    """
+    Exponential backoff with full jitter between the reconnect attempts,
+    the n-th retry waits a random time between 0 and min(cap, base * 2 ** n),
+    so the devices dropped at the same moment don't come back in lockstep.
+    """
+    def __init__(self, base=5, cap=300, multiplier=2):
+        self._base = base
+        self._cap = cap
+        self._multiplier = multiplier
+        self._attempts = 0
+        self._exponent = 0
+
+    @property
+    def attempts(self):
+        return self._attempts
+
+    def configure(self, base=None, cap=None):
+        if base is not None:
+            self._base = base
+        if cap is not None:
+            self._cap = cap
+
+    def next_delay(self):
+        backoff = self._base * self._multiplier ** self._exponent
+        if backoff < self._cap:
+            # Stop growing at the cap, a device missing for good would overflow the float
+            self._exponent += 1
+        self._attempts += 1
+        return random.uniform(0, min(self._cap, backoff))
+
+    def reset(self):
+        self._attempts = 0
+        self._exponent = 0
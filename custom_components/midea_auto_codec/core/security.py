@@ -11,6 +11,15 @@ MSGTYPE_HANDSHAKE_RESPONSE = 0x1
 MSGTYPE_ENCRYPTED_RESPONSE = 0x3
 MSGTYPE_ENCRYPTED_REQUEST = 0x6
 
+LOCAL_AES_KEY = bytes.fromhex(
+    format(141661095494369103254425781617665632877, 'x')
+)
+LOCAL_SALT = bytes.fromhex(
+    format(233912452794221312800602098970898185176935770387238278451789080441632479840061417076563, 'x')
+)
+# ECB keeps no state between calls, one cipher object serves every device and both directions
+_LOCAL_ECB = AES.new(LOCAL_AES_KEY, AES.MODE_ECB)
+
 
 class CloudSecurity:
     def __init__(self, login_key, iot_key, hmac_key, fixed_key=None, fixed_iv=None):
@@ -147,24 +156,20 @@ class LocalSecurity:
     def __init__(self):
         self.blockSize = 16
         self.iv = b"\0" * 16
-        self.aes_key = bytes.fromhex(
-            format(141661095494369103254425781617665632877, 'x')
-        )
-        self.salt = bytes.fromhex(
-            format(233912452794221312800602098970898185176935770387238278451789080441632479840061417076563, 'x')
-        )
+        self.aes_key = LOCAL_AES_KEY
+        self.salt = LOCAL_SALT
         self._tcp_key = None
         self._request_count = 0
         self._response_count = 0
 
     def aes_decrypt(self, raw):
         try:
-            return unpad(AES.new(self.aes_key, AES.MODE_ECB).decrypt(bytearray(raw)), 16)
+            return unpad(_LOCAL_ECB.decrypt(raw), 16)
         except ValueError as e:
             return bytearray(0)
 
     def aes_encrypt(self, raw):
-        return AES.new(self.aes_key, AES.MODE_ECB).encrypt(bytearray(pad(raw, 16)))
+        return _LOCAL_ECB.encrypt(pad(raw, 16))
 
     def aes_cbc_decrypt(self, raw, key):
         return AES.new(key=key, mode=AES.MODE_CBC, iv=self.iv).decrypt(raw)
@@ -210,18 +215,21 @@ class LocalSecurity:
         return header + data
 
     def decode_8370(self, data):
-        if len(data) < 6:
-            return [], data
-        header = data[:6]
+        packets = []
+        view = memoryview(data)
+        offset = 0
+        while len(view) - offset >= 6:
+            size = int.from_bytes(view[offset + 2:offset + 4], "big") + 8
+            if len(view) - offset < size:
+                break
+            packets.append(self.decode_8370_packet(view[offset:offset + size]))
+            offset += size
+        return packets, bytes(view[offset:])
+
+    def decode_8370_packet(self, data):
+        header = bytes(data[:6])
         if header[0] != 0x83 or header[1] != 0x70:
             raise Exception("not an 8370 message")
-        size = int.from_bytes(header[2:4], "big") + 8
-        leftover = None
-        if len(data) < size:
-            return [], data
-        elif len(data) > size:
-            leftover = data[size:]
-            data = data[:size]
         if header[4] != 0x20:
             raise Exception("missing byte 4")
         padding = header[5] >> 4
@@ -236,8 +244,4 @@ class LocalSecurity:
             if padding:
                 data = data[:-padding]
         self._response_count = int.from_bytes(data[:2], "big")
-        data = data[2:]
-        if leftover:
-            packets, incomplete = self.decode_8370(leftover)
-            return [data] + packets, incomplete
-        return [data], b""
+        return data[2:]
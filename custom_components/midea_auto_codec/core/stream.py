@@ -0,0 +1,49 @@
+class StreamBuffer:
+    """
+    Reassembles the received TCP stream into 5A5A (V2) or 8370 (V3) packets.
+    Received data is appended to one bytearray and the packets are handed out
+    as memoryviews into it, the consumed bytes are dropped once per feed.
+    The packets must not be kept after the next feed.
+    """
+    def __init__(self):
+        self._buffer = bytearray()
+        self._offset = 0
+
+    def __len__(self):
+        return len(self._buffer) - self._offset
+
+    def clear(self):
+        self._buffer = bytearray()
+        self._offset = 0
+
+    def feed(self, data):
+        if self._offset > 0:
+            try:
+                del self._buffer[:self._offset]
+            except BufferError:
+                # Someone still holds a packet of the last feed
+                self._buffer = self._buffer[self._offset:]
+            self._offset = 0
+        self._buffer += data
+
+    def _fetch(self, header_length, packet_length):
+        packets = []
+        view = memoryview(self._buffer)
+        end = len(view)
+        while end - self._offset >= header_length:
+            length = packet_length(view, self._offset)
+            if length < header_length:
+                # A broken length would never complete, drop everything received
+                self._offset = end
+                break
+            if end - self._offset < length:
+                break
+            packets.append(view[self._offset:self._offset + length])
+            self._offset += length
+        return packets
+
+    def fetch_v2(self):
+        return self._fetch(6, lambda view, offset: view[offset + 4] + (view[offset + 5] << 8))
+
+    def fetch_8370(self):
+        return self._fetch(6, lambda view, offset: (view[offset + 2] << 8) + view[offset + 3] + 8)
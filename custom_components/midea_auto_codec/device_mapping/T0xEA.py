@@ -20,8 +20,32 @@ DEVICE_MAPPING = {
                     "rvalue": "[order_time_hour] * 60 + [order_time_min]",
                 }
             ],
-            "set": {
-            }
+            "set": [
+                {
+                    "lvalue": "[left_time_hour]",
+                    "rvalue": "[remaining_time] // 60"
+                },
+                {
+                    "lvalue": "[left_time_min]",
+                    "rvalue": "[remaining_time] % 60"
+                },
+                {
+                    "lvalue": "[warm_time_hour]",
+                    "rvalue": "[warming_time] // 60"
+                },
+                {
+                    "lvalue": "[warm_time_min]",
+                    "rvalue": "[warming_time] % 60"
+                },
+                {
+                    "lvalue": "[order_time_hour]",
+                    "rvalue": "[delay_time] // 60"
+                },
+                {
+                    "lvalue": "[order_time_min]",
+                    "rvalue": "[delay_time] % 60"
+                }
+            ]
         },
         "entities": {
             Platform.SENSOR: {
@@ -111,8 +135,32 @@ DEVICE_MAPPING = {
                     "rvalue": "[order_time_hour] * 60 + [order_time_min]",
                 }
             ],
-            "set": {
-            }
+            "set": [
+                {
+                    "lvalue": "[left_time_hour]",
+                    "rvalue": "[remaining_time] // 60"
+                },
+                {
+                    "lvalue": "[left_time_min]",
+                    "rvalue": "[remaining_time] % 60"
+                },
+                {
+                    "lvalue": "[warm_time_hour]",
+                    "rvalue": "[warming_time] // 60"
+                },
+                {
+                    "lvalue": "[warm_time_min]",
+                    "rvalue": "[warming_time] % 60"
+                },
+                {
+                    "lvalue": "[order_time_hour]",
+                    "rvalue": "[delay_time] // 60"
+                },
+                {
+                    "lvalue": "[order_time_min]",
+                    "rvalue": "[delay_time] % 60"
+                }
+            ]
         },
         "entities": {
             Platform.SENSOR: {
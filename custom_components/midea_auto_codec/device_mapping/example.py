@@ -7,7 +7,7 @@ DEVICE_MAPPING = {
     "default": {
         "manufacturer": "小天鹅",
         "rationale": ["off", "on"],
-        "queries": [{}, {"query_type": "prevent_straight_wind"}],
+        "queries": [{}, {"query": {"query_type": "prevent_straight_wind"}, "interval": 3600}],
         "centralized": [
             "power", "temperature", "small_temperature", "mode", "eco",
             "comfort_power_save", "comfort_sleep", "strong_wind",
@@ -24,7 +24,7 @@ DEVICE_MAPPING = {
                     "rvalue": "[current_temperature] / 2"
                 }
             ],
-            "set": {
+            "set": [
                 {
                     "lvalue": "[target_temperature]",
                     "rvalue": "[target_temperature_new] * 2"
@@ -33,7 +33,7 @@ DEVICE_MAPPING = {
                     "lvalue": "[current_temperature]",
                     "rvalue": "[current_temperature_new] * 2"
                 }
-            }
+            ]
         },
         "entities": {
             Platform.CLIMATE: {
@@ -0,0 +1,59 @@
+from homeassistant.components.diagnostics import async_redact_data
+from homeassistant.config_entries import ConfigEntry
+from homeassistant.core import HomeAssistant
+from homeassistant.const import (
+    CONF_TYPE,
+    CONF_DEVICE_ID,
+    CONF_DEVICE,
+    CONF_TOKEN,
+    CONF_PASSWORD
+)
+from .core.device import MiedaDevice
+from .core.engine import MideaEngine
+from .core.lua_runtime import codec_pool
+from .const import (
+    DOMAIN,
+    DEVICES,
+    CONF_KEY,
+    CONF_SN,
+    CONF_ACCOUNT
+)
+
+TO_REDACT = {CONF_TOKEN, CONF_KEY, CONF_PASSWORD, CONF_ACCOUNT, CONF_SN}
+
+
+async def async_get_config_entry_diagnostics(hass: HomeAssistant, config_entry: ConfigEntry) -> dict:
+    diagnostics = {
+        "entry": {
+            "data": async_redact_data(dict(config_entry.data), TO_REDACT),
+            "options": async_redact_data(dict(config_entry.options), TO_REDACT)
+        }
+    }
+    if config_entry.data.get(CONF_TYPE) == CONF_ACCOUNT:
+        return diagnostics
+    device_id = config_entry.data.get(CONF_DEVICE_ID)
+    device: MiedaDevice = hass.data.get(DOMAIN, {}).get(DEVICES, {}).get(device_id, {}).get(CONF_DEVICE)
+    if device is None:
+        return diagnostics
+    connections = MideaEngine.instance().connections
+    diagnostics["device"] = {
+        "device_id": device.device_id,
+        "device_type": "T0x%02X" % device.device_type,
+        "model": device.model,
+        "subtype": device.subtype,
+        "ip_address": device.ip_address,
+        "connected": device.connected,
+        "attributes": async_redact_data(device.attributes, TO_REDACT),
+        "handshake": device.handshake_stats,
+        "metrics": device.metrics.snapshot(),
+        "capture": device.capture.path if device.capture is not None else None
+    }
+    diagnostics["engine"] = {
+        "connections": {
+            "limit": connections.limit,
+            "active": connections.active,
+            "waiting": connections.waiting
+        },
+        "lua_runtimes": codec_pool.stats()
+    }
+    return diagnostics
@@ -105,8 +105,8 @@ class MideaFanEntity(MideaEntity, FanEntity):
         if self.oscillating != oscillating:
             self._set_status_on_off(self._key_oscillate, oscillating)
 
-    def update_state(self, status):
-        try:
-            self.schedule_update_ha_state()
-        except Exception as e:
-            pass
+    @property
+    def subscribed_attributes(self):
+        return self._collect_attributes(
+            self._key_power, self._key_preset_modes, self._key_speeds, self._key_oscillate, self._key_directions
+        )
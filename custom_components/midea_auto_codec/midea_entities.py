@@ -1,4 +1,5 @@
 from enum import IntEnum
+from homeassistant.core import callback
 from homeassistant.helpers.entity import Entity
 from homeassistant.const import (
     STATE_ON,
@@ -14,10 +15,84 @@ class Rationale(IntEnum):
     LESS = 2
 
 
+class SelectionMatcher:
+    """
+    Finds the first of the statuses matching the attributes of the device,
+    such as the mode in {"cool": {"power": "on", "mode": "cool"}, ...} or
+    the index in [{"wind_speed": 40}, ...].
+    For exact matching the statuses are grouped by their attribute names and
+    each group is indexed by the values, so a lookup costs one dict access
+    per group instead of comparing every status. The result is kept until
+    invalidate() is called.
+    """
+    def __init__(self, statuses, rationale=Rationale.EQUALLY):
+        self._items = list(statuses.items()) if isinstance(statuses, dict) else list(enumerate(statuses))
+        self._rationale = rationale
+        self._groups = None
+        if rationale is Rationale.EQUALLY:
+            groups = {}
+            try:
+                for order, (key, status) in enumerate(self._items):
+                    attrs = tuple(sorted(status.keys()))
+                    groups.setdefault(attrs, {}).setdefault(tuple(status[attr] for attr in attrs), (order, key))
+                self._groups = list(groups.items())
+            except TypeError:
+                # Unhashable values in the statuses, compare them one by one
+                self._groups = None
+        self._valid = False
+        self._result = None
+
+    def invalidate(self):
+        self._valid = False
+
+    def match(self, get_attribute):
+        if not self._valid:
+            self._result = self._match(get_attribute)
+            self._valid = True
+        return self._result
+
+    def _match(self, get_attribute):
+        if self._groups is None:
+            return self._scan(get_attribute)
+        selected = None
+        for attrs, lookup in self._groups:
+            values = tuple(get_attribute(attr) for attr in attrs)
+            if None in values:
+                continue
+            try:
+                found = lookup.get(values)
+            except TypeError:
+                return self._scan(get_attribute)
+            if found is not None and (selected is None or found[0] < selected[0]):
+                selected = found
+        return None if selected is None else selected[1]
+
+    def _scan(self, get_attribute):
+        for key, status in self._items:
+            match = True
+            for attr, value in status.items():
+                state_value = get_attribute(attr)
+                if state_value is None:
+                    match = False
+                    break
+                if self._rationale is Rationale.EQUALLY and state_value != value:
+                    match = False
+                    break
+                if self._rationale is Rationale.GREATER and state_value < value:
+                    match = False
+                    break
+                if self._rationale is Rationale.LESS and state_value > value:
+                    match = False
+                    break
+            if match:
+                return key
+        return None
+
+
 class MideaEntity(Entity):
     def __init__(self, device, manufacturer: str | None, rationale: list | None, entity_key: str, config: dict):
         self._device = device
-        self._device.register_update(self.update_state)
+        self._matchers = {}
         self._entity_key = entity_key
         self._config = config
         self._device_name = self._device.device_name
@@ -47,6 +122,37 @@ class MideaEntity(Entity):
     def device(self):
         return self._device
 
+    @property
+    def subscribed_attributes(self):
+        """
+        The attributes this entity shows, it's only updated when one of them changed.
+        None to be updated on every change.
+        """
+        return {self._entity_key}
+
+    @staticmethod
+    def _collect_attributes(*keys):
+        # Attribute names from the entity config: a name, a list of names,
+        # a list of statuses or a dict of statuses such as {"cool": {"mode": "cool"}}
+        attributes = set()
+        for key in keys:
+            if isinstance(key, str):
+                attributes.add(key)
+            elif isinstance(key, list):
+                for item in key:
+                    attributes.update(item.keys() if isinstance(item, dict) else [item])
+            elif isinstance(key, dict):
+                for item in key.values():
+                    if isinstance(item, dict):
+                        attributes.update(item.keys())
+        return attributes
+
+    async def async_added_to_hass(self):
+        self._device.register_update(self.update_state, self.subscribed_attributes)
+
+    async def async_will_remove_from_hass(self):
+        self._device.unregister_update(self.update_state)
+
     @property
     def should_poll(self):
         return False
@@ -69,54 +175,26 @@ class MideaEntity(Entity):
     def _set_status_on_off(self, status_key: str, turn_on: bool):
         self._device.set_attribute(status_key, self._rationale[int(turn_on)])
 
+    def _matcher(self, statuses, rationale):
+        key = (id(statuses), rationale)
+        if (matcher := self._matchers.get(key)) is None:
+            matcher = SelectionMatcher(statuses, rationale)
+            self._matchers[key] = matcher
+        return matcher
+
     def _list_get_selected(self, key_of_list: list, rationale: Rationale = Rationale.EQUALLY):
-        for index in range(0, len(key_of_list)):
-            match = True
-            for attr, value in key_of_list[index].items():
-                state_value = self._device.get_attribute(attr)
-                if state_value is None:
-                    match = False
-                    break
-                if rationale is Rationale.EQUALLY and state_value != value:
-                    match = False
-                    break
-                if rationale is Rationale.GREATER and state_value < value:
-                    match = False
-                    break
-                if rationale is Rationale.LESS and state_value > value:
-                    match = False
-                    break
-            if match:
-                return index
-        return None
+        return self._matcher(key_of_list, rationale).match(self._device.get_attribute)
 
     def _dict_get_selected(self, key_of_dict: dict, rationale: Rationale = Rationale.EQUALLY):
-        for mode, status in key_of_dict.items():
-            match = True
-            for attr, value in status.items():
-                state_value = self._device.get_attribute(attr)
-                if state_value is None:
-                    match = False
-                    break
-                if rationale is Rationale.EQUALLY and state_value != value:
-                    match = False
-                    break
-                if rationale is Rationale.GREATER and state_value < value:
-                    match = False
-                    break
-                if rationale is Rationale.LESS and state_value > value:
-                    match = False
-                    break
-            if match:
-                return mode
-        return None
+        return self._matcher(key_of_dict, rationale).match(self._device.get_attribute)
 
+    @callback
     def update_state(self, status):
-        if self._entity_key in status or "connected" in status:
-            try:
-                self.schedule_update_ha_state()
-            except Exception as e:
-                pass
+        # Called in the event loop of Home Assistant, see MiedaDevice.set_update_loop
+        for matcher in self._matchers.values():
+            matcher.invalidate()
+        if self.hass is not None:
+            self.async_write_ha_state()
 
 
 class MideaBinaryBaseEntity(MideaEntity):
@@ -42,9 +42,7 @@ class MideaSelectEntity(MideaEntity, SelectEntity):
         new_status = self._key_options.get(option)
         self._device.set_attributes(new_status)
 
-    def update_state(self, status):
-        try:
-            self.schedule_update_ha_state()
-        except Exception as e:
-            pass
+    @property
+    def subscribed_attributes(self):
+        return self._collect_attributes(self._key_options)
 
@@ -5,12 +5,69 @@ from homeassistant.const import (
     CONF_DEVICE,
     CONF_ENTITIES
 )
+from homeassistant.helpers.entity import EntityCategory
 from .const import (
     DOMAIN,
     DEVICES
 )
 from .midea_entities import MideaEntity
 
+# The runtime metrics of the device, the key in DeviceMetrics.snapshot(),
+# a nested key like round_trip_time.average as a tuple
+METRIC_SENSORS = {
+    "round_trip_time": {
+        "name": "Round Trip Time",
+        "metric": ("round_trip_time", "average"),
+        "unit_of_measurement": "ms",
+        "state_class": "measurement",
+        "icon": "mdi:timer-outline",
+        "enabled": True
+    },
+    "decode_time": {
+        "name": "Decode Time",
+        "metric": ("decode_time", "average"),
+        "unit_of_measurement": "ms",
+        "state_class": "measurement",
+        "icon": "mdi:timer-cog-outline"
+    },
+    "frame_rate": {
+        "name": "Frame Rate",
+        "metric": ("frame_rate",),
+        "unit_of_measurement": "frames/s",
+        "state_class": "measurement",
+        "icon": "mdi:swap-vertical"
+    },
+    "reconnects": {
+        "name": "Reconnects",
+        "metric": ("reconnects",),
+        "state_class": "total_increasing",
+        "icon": "mdi:lan-disconnect",
+        "enabled": True
+    },
+    "heartbeat_timeouts": {
+        "name": "Heartbeat Timeouts",
+        "metric": ("heartbeat_timeouts",),
+        "state_class": "total_increasing",
+        "icon": "mdi:heart-off-outline"
+    },
+    "bytes_received": {
+        "name": "Bytes Received",
+        "metric": ("bytes_received",),
+        "unit_of_measurement": "B",
+        "device_class": "data_size",
+        "state_class": "total_increasing",
+        "icon": "mdi:download-network-outline"
+    },
+    "bytes_sent": {
+        "name": "Bytes Sent",
+        "metric": ("bytes_sent",),
+        "unit_of_measurement": "B",
+        "device_class": "data_size",
+        "state_class": "total_increasing",
+        "icon": "mdi:upload-network-outline"
+    }
+}
+
 
 async def async_setup_entry(hass, config_entry, async_add_entities):
     device_id = config_entry.data.get(CONF_DEVICE_ID)
@@ -22,6 +79,8 @@ async def async_setup_entry(hass, config_entry, async_add_entities):
     if entities is not None:
         for entity_key, config in entities.items():
             devs.append(MideaSensorEntity(device, manufacturer, rationale, entity_key, config))
+    for metric_key, config in METRIC_SENSORS.items():
+        devs.append(MideaMetricSensorEntity(device, manufacturer, rationale, metric_key, config))
     async_add_entities(devs)
 
 
@@ -30,3 +89,31 @@ class MideaSensorEntity(MideaEntity, SensorEntity):
     @property
     def native_value(self):
         return self._device.get_attribute(self._entity_key)
+
+
+class MideaMetricSensorEntity(MideaEntity, SensorEntity):
+    _attr_entity_category = EntityCategory.DIAGNOSTIC
+
+    def __init__(self, device, manufacturer, rationale, entity_key, config):
+        super().__init__(device, manufacturer, rationale, entity_key, config)
+        self._attr_entity_registry_enabled_default = config.get("enabled", False)
+
+    @property
+    def should_poll(self):
+        # The metrics change with every frame, polled rather than written each time
+        return True
+
+    @property
+    def available(self):
+        return True
+
+    @property
+    def subscribed_attributes(self):
+        return set()
+
+    @property
+    def native_value(self):
+        value = self._device.metrics.snapshot()
+        for key in self._config.get("metric"):
+            value = value.get(key)
+        return value
@@ -120,9 +120,10 @@ class MideaWaterHeaterEntityEntity(MideaEntity, WaterHeaterEntity):
         new_status = self._key_operation_list.get(operation_mode)
         self._device.set_attributes(new_status)
 
-    def update_state(self, status):
-        try:
-            self.schedule_update_ha_state()
-        except Exception as e:
-            pass
+    @property
+    def subscribed_attributes(self):
+        return self._collect_attributes(
+            self._key_power, self._key_operation_list, self._key_min_temp, self._key_max_temp,
+            self._key_current_temperature, self._key_target_temperature
+        )
 